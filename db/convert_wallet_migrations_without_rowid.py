@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Migration script: reconstruit wallet_migrations en table WITHOUT ROWID.
+La clé primaire (old_wallet, new_wallet, migration_date) sert directement
+l'INSERT OR IGNORE et la branche old_wallet de get_wallet_migration_chain ;
+un index sur new_wallet couvre la branche OR restante.
+"""
+
+import sqlite3
+from pathlib import Path
+
+from smart_wallet_analysis.logger import get_logger
+
+# Configuration
+DB_PATH = Path(__file__).parent.parent / "data" / "db" / "wit_database.db"
+logger = get_logger("db.convert_wallet_migrations_without_rowid")
+
+
+def convert_wallet_migrations_without_rowid():
+    """Convertit wallet_migrations en WITHOUT ROWID"""
+
+    logger.info("🔧 === MIGRATION: WALLET_MIGRATIONS WITHOUT ROWID ===")
+
+    conn = None
+    try:
+        conn = sqlite3.connect(str(DB_PATH))
+        cursor = conn.cursor()
+
+        # 1. Vérifier l'état actuel de la table
+        cursor.execute("SELECT sql FROM sqlite_master WHERE type='table' AND name='wallet_migrations'")
+        current_schema = cursor.fetchone()
+        if not current_schema:
+            logger.info("❌ Table wallet_migrations non trouvée!")
+            return False
+        if "WITHOUT ROWID" in current_schema[0].upper():
+            logger.info("✅ wallet_migrations est déjà WITHOUT ROWID, aucune migration nécessaire")
+            return True
+
+        columns = {row[1] for row in cursor.execute("PRAGMA table_info(wallet_migrations)")}
+        cursor.execute("SELECT COUNT(*) FROM wallet_migrations")
+        total_records = cursor.fetchone()[0]
+        logger.info(f"📊 {total_records} enregistrements existants dans wallet_migrations")
+
+        # 2. Créer la nouvelle table
+        cursor.execute("DROP TABLE IF EXISTS wallet_migrations_new")
+        cursor.execute("""
+            CREATE TABLE wallet_migrations_new (
+                old_wallet TEXT NOT NULL,
+                new_wallet TEXT NOT NULL,
+                migration_date TEXT NOT NULL,
+                migration_ts INTEGER,
+                tokens_transferred TEXT,
+                total_value_transferred REAL,
+                transfer_percentage REAL,
+                is_validated INTEGER DEFAULT 1,
+                PRIMARY KEY (old_wallet, new_wallet, migration_date)
+            ) WITHOUT ROWID
+        """)
+
+        # 3. Copier les données (migration_ts recalculé si la colonne n'existe pas encore)
+        migration_ts_expr = (
+            "COALESCE(migration_ts, CAST(strftime('%s', migration_date) AS INTEGER))"
+            if "migration_ts" in columns
+            else "CAST(strftime('%s', migration_date) AS INTEGER)"
+        )
+        cursor.execute(f"""
+            INSERT OR IGNORE INTO wallet_migrations_new (
+                old_wallet, new_wallet, migration_date, migration_ts,
+                tokens_transferred, total_value_transferred, transfer_percentage, is_validated
+            )
+            SELECT old_wallet, new_wallet, COALESCE(migration_date, ''), {migration_ts_expr},
+                   tokens_transferred, total_value_transferred, transfer_percentage, is_validated
+            FROM wallet_migrations
+            WHERE old_wallet IS NOT NULL AND new_wallet IS NOT NULL
+        """)
+
+        cursor.execute("SELECT COUNT(*) FROM wallet_migrations_new")
+        new_total = cursor.fetchone()[0]
+        logger.info(f"📊 Avant: {total_records} enregistrements | Après: {new_total}")
+        if new_total < total_records:
+            logger.info(f"⚠️ {total_records - new_total} enregistrements ignorés (doublons ou wallets NULL)")
+
+        # 4. Remplacer l'ancienne table (ses index disparaissent avec elle)
+        cursor.execute("DROP TABLE wallet_migrations")
+        cursor.execute("ALTER TABLE wallet_migrations_new RENAME TO wallet_migrations")
+
+        # 5. Index pour la branche new_wallet de get_wallet_migration_chain
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_wm_new_wallet ON wallet_migrations(new_wallet)")
+
+        conn.commit()
+        cursor.execute("ANALYZE wallet_migrations")
+        logger.info("🎉 === MIGRATION TERMINÉE AVEC SUCCÈS ===")
+        return True
+
+    except Exception as e:
+        logger.info(f"❌ Erreur durant la migration: {e}")
+        if conn:
+            conn.rollback()
+        return False
+    finally:
+        if conn:
+            conn.close()
+
+
+if __name__ == "__main__":
+    convert_wallet_migrations_without_rowid()
@@ -306,14 +306,12 @@ def create_manual_database():
     cursor.execute("CREATE INDEX IF NOT EXISTS idx_wallets_extracted ON wallets(transactions_extracted);")
     cursor.execute("CREATE INDEX IF NOT EXISTS idx_wallets_scored ON wallets(is_scored);")
 
-    cursor.execute("CREATE INDEX IF NOT EXISTS idx_tokens_wallet ON tokens(wallet_address);")
     cursor.execute("CREATE INDEX IF NOT EXISTS idx_tokens_symbol ON tokens(symbol);")
     cursor.execute("CREATE INDEX IF NOT EXISTS idx_tokens_portfolio ON tokens(in_portfolio);")
 
     cursor.execute("CREATE INDEX IF NOT EXISTS idx_tx_history_wallet ON transaction_history(wallet_address);")
     cursor.execute("CREATE INDEX IF NOT EXISTS idx_tx_history_symbol ON transaction_history(symbol);")
     cursor.execute("CREATE INDEX IF NOT EXISTS idx_tx_history_date ON transaction_history(date);")
-    cursor.execute("CREATE INDEX IF NOT EXISTS idx_tx_history_hash ON transaction_history(hash);")
 
     cursor.execute("CREATE INDEX IF NOT EXISTS idx_token_analytics_wallet ON token_analytics(wallet_address);")
     cursor.execute("CREATE INDEX IF NOT EXISTS idx_token_analytics_symbol ON token_analytics(token_symbol);")
@@ -90,11 +90,9 @@ def create_tables():
     
     # Index pour les performances
     cursor.execute("CREATE INDEX IF NOT EXISTS idx_wallets_portfolio ON wallets(total_portfolio_value);")
-    cursor.execute("CREATE INDEX IF NOT EXISTS idx_tokens_wallet ON tokens(wallet_address);")
     cursor.execute("CREATE INDEX IF NOT EXISTS idx_tokens_symbol ON tokens(symbol);")
     cursor.execute("CREATE INDEX IF NOT EXISTS idx_tx_history_wallet ON transaction_history(wallet_address);")
     cursor.execute("CREATE INDEX IF NOT EXISTS idx_tx_history_date ON transaction_history(date);")
-    cursor.execute("CREATE INDEX IF NOT EXISTS idx_tx_history_hash ON transaction_history(hash);")
     
     # === NOUVELLES TABLES POUR TRACKING LIVE DES CHANGEMENTS ===
     
@@ -162,7 +160,7 @@ def create_tables():
     
     # Index pour performance des nouvelles tables
     cursor.execute("CREATE INDEX IF NOT EXISTS idx_wallet_brute_token ON wallet_brute(token_address);")
-    cursor.execute("CREATE INDEX IF NOT EXISTS idx_wallet_brute_wallet ON wallet_brute(wallet_address);")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_wallet_brute_wallet_temporality ON wallet_brute(wallet_address, temporality);")
     cursor.execute("CREATE INDEX IF NOT EXISTS idx_wallet_brute_chain ON wallet_brute(chain);")
     cursor.execute("CREATE INDEX IF NOT EXISTS idx_wallet_brute_temporality ON wallet_brute(temporality);")
     cursor.execute("CREATE INDEX IF NOT EXISTS idx_wallet_brute_detection_date ON wallet_brute(detection_date);")
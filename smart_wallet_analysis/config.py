@@ -24,6 +24,8 @@ TOKEN_DISCOVERY_MANUAL = {
     "ETHERSCAN_MAX_RETRIES": 3,
     "ETHERSCAN_RETRY_BACKOFF_SECONDS": 0.5,
     "ETHERSCAN_RATE_LIMIT_SLEEP_SECONDS": 10,
+    "ETHERSCAN_BATCH_WORKERS": 4,
+    "ALCHEMY_RPC_URL": "https://eth-mainnet.g.alchemy.com/v2/",
     "CHAIN_MAPPING": {
         "base": "base",
         "ethereum": "ethereum",
@@ -173,14 +175,18 @@ WALLET_TRACKER = {
     "TRASH_NAMES": ("test", "airdrop", "scam", "spam", "fake", "shit"),
     "TRASH_SYMBOLS": ("test", "fake", "scam", "spam", "lplz"),
     "RATE_LIMIT_SLEEP_SECONDS": 5,
+    "MAX_RETRIES": 5,
+    "RETRY_BACKOFF_BASE_SECONDS": 1.0,
+    "RETRY_BACKOFF_CAP_SECONDS": 60,
     "PAGE_DELAY_SECONDS": 0.3,
+    "MAX_REQUESTS_PER_SECOND": 4,
     "MAX_PAGES_DEFAULT": 2000,
     "PAGE_SIZE": 100,
     "HTTP_TIMEOUT_SECONDS": 30,
     "BATCH_SIZE_DEFAULT": 10,
     "BATCH_DELAY_SECONDS": 30,
     "BATCH_DELAY_SECONDS_MAIN": 10,
-    "WALLET_DELAY_SECONDS": 3
+    "MAX_WORKERS": 4
 }
 
 WALLET_BALANCES = {
@@ -191,6 +197,7 @@ WALLET_BALANCES = {
     "MAX_TOKENS_PER_WALLET": 60,
     "BATCH_SIZE": 5,
     "DELAY_BETWEEN_BATCHES": 5,
+    "WALLET_PAGE_SIZE": 500,
     "PERIODS": ("14d", "30d", "200d", "360d", "manual"),
     "EXCLUDED_TOKENS": (
         "USDC", "USDT", "DAI", "BUSD", "FRAX", "TUSD", "USDP", "GUSD", "LUSD", "MIM", "USTC", "UST",
@@ -216,9 +223,12 @@ WALLET_BALANCES = {
         "ONE", "WONE", "STONE", "HARMONY", "TONE", "VONE", "SONE"
     ),
     "TOKEN_LOOKUP_DELAY": 0.2,
+    "MAX_REQUESTS_PER_SECOND": 10,
     "FUNGIBLE_TIMEOUT_SECONDS": 10,
     "POSITIONS_TIMEOUT_SECONDS": 30,
-    "RATE_LIMIT_SLEEP_SECONDS": 5
+    "MAX_RETRIES": 5,
+    "RETRY_BACKOFF_BASE_SECONDS": 1.0,
+    "RETRY_BACKOFF_CAP_SECONDS": 30
 }
 
 TRACKING_LIVE = {
@@ -254,14 +264,20 @@ TRACKING_LIVE = {
 MIGRATION_DETECTOR = {
     "HOURS_LOOKBACK": 168,
     "MIN_TRANSFER_PERCENTAGE": 70,
+    "MIN_PORTFOLIO_VALUE_USD": 1000,
     "MAX_DAYS": 7,
     "MAX_PAGES": 10,
     "RETRIES": 3,
+    "HTTP_TIMEOUT_SECONDS": 15,
+    "HTTP_RETRY_BACKOFF": 1.5,
+    "HTTP_RETRY_STATUS": (500, 502, 503, 504),
+    "HTTP_POOL_SIZE": 16,
+    "KEY_MIN_INTERVAL_SECONDS": 1.0,
     "RATE_LIMIT_SLEEP_SECONDS": 3,
-    "PAGE_DELAY_SECONDS": 1.5,
-    "RETRY_DELAY_SECONDS": 2,
-    "SHORT_SLEEP_SECONDS": 0.5,
-    "AFTER_MIGRATION_SLEEP_SECONDS": 1.0
+    "FILS_FETCH_CONCURRENCY": 2,
+    "EOA_CACHE_TTL_DAYS": 7,
+    "AFTER_MIGRATION_SLEEP_SECONDS": 1.0,
+    "MAX_WORKERS": 4
 }
 
 TOKEN_DISCOVERY = {
@@ -0,0 +1,24 @@
+"""Encodage/décodage JSON partagé : orjson si disponible, sinon json standard."""
+
+import json
+
+# orjson n'est pas dans requirements.txt : dépendance optionnelle, même comportement sans
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+
+def loads(data):
+    """Décode un document JSON (bytes ou str) ; lève ValueError si invalide."""
+    return orjson.loads(data) if ORJSON_AVAILABLE else json.loads(data)
+
+
+def dumps(obj, indent: bool = False) -> str:
+    """Encode en JSON (UTF-8 non échappé) : compact, ou indenté sur 2 espaces si indent."""
+    if ORJSON_AVAILABLE:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 if indent else None).decode()
+    if indent:
+        return json.dumps(obj, indent=2, ensure_ascii=False)
+    return json.dumps(obj, separators=(",", ":"), ensure_ascii=False)
@@ -2,7 +2,8 @@
 
 import os
 import time
-from typing import Optional
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, Optional
 
 import requests
 from dotenv import load_dotenv
@@ -15,13 +16,15 @@ load_dotenv(dotenv_path=ENV_PATH)
 logger = get_logger("token_discovery.manual.contract_checker")
 _TDM = TOKEN_DISCOVERY_MANUAL
 _ETHERSCAN_API = os.getenv("ETHERSCAN_API_KEY")
+_ALCHEMY_API = os.getenv("ALCHEMY_API_KEY")
 
 
 class ContractChecker:
     """Checker Etherscan pour distinguer EOA et smart contracts."""
 
-    def __init__(self, api_key: Optional[str] = None):
+    def __init__(self, api_key: Optional[str] = None, rpc_url: Optional[str] = None):
         self.api_key = api_key or _ETHERSCAN_API
+        self.rpc_url = rpc_url or (f"{_TDM['ALCHEMY_RPC_URL']}{_ALCHEMY_API}" if _ALCHEMY_API else None)
         self.session = requests.Session()
         self.session.headers.update({"User-Agent": "WIT-Contract-Checker/1.0"})
         if not self.api_key:
@@ -74,3 +77,31 @@ class ContractChecker:
             backoff = _TDM["ETHERSCAN_RETRY_BACKOFF_SECONDS"] * (retry_count + 1)
             time.sleep(backoff)
             return self.is_contract_single(address, retry_count + 1)
+
+    def is_contract_batch(self, addresses: Iterable[str]) -> Dict[str, Optional[bool]]:
+        """Vérifie plusieurs adresses ; un seul batch JSON-RPC eth_getCode si ALCHEMY_API_KEY est défini."""
+        addresses = list(dict.fromkeys(addresses))
+        if not addresses:
+            return {}
+
+        if self.rpc_url:
+            payload = [
+                {"jsonrpc": "2.0", "id": i, "method": "eth_getCode", "params": [address, "latest"]}
+                for i, address in enumerate(addresses)
+            ]
+            try:
+                response = self.session.post(
+                    self.rpc_url, json=payload, timeout=_TDM["ETHERSCAN_TIMEOUT_SECONDS"]
+                )
+                response.raise_for_status()
+                codes = {item.get("id"): item.get("result") for item in response.json() if "error" not in item}
+                return {
+                    address: (bool(codes[i] and codes[i] != "0x") if i in codes else None)
+                    for i, address in enumerate(addresses)
+                }
+            except (requests.RequestException, ValueError, AttributeError, TypeError) as e:
+                logger.warning("Batch eth_getCode indisponible (%s), repli sur Etherscan", e)
+
+        # Repli Etherscan : appels unitaires en parallèle limité (quota 5 req/s)
+        with ThreadPoolExecutor(max_workers=_TDM["ETHERSCAN_BATCH_WORKERS"]) as executor:
+            return dict(zip(addresses, executor.map(self.is_contract_single, addresses)))
@@ -3,7 +3,7 @@ import time
 import requests
 import pandas as pd
 import sqlite3
-import uuid
+import secrets
 from datetime import datetime
 from dotenv import load_dotenv
 from requests.adapters import HTTPAdapter
@@ -61,6 +61,17 @@ def get_smart_wallets_from_db():
         return []
 
 
+def get_smart_wallet_set():
+    """Charge une seule fois l'ensemble des smart wallets actifs (tier > 0)."""
+    try:
+        with sqlite3.connect(DB_PATH) as conn:
+            rows = conn.execute("SELECT wallet_address FROM smart_wallets WHERE optimal_threshold_tier > 0").fetchall()
+        return frozenset(row[0] for row in rows)
+    except Exception as e:
+        logger.warning(f"Erreur récupération smart wallets, filtre SQL conservé: {e}")
+        return None
+
+
 def create_http_session():
     """Crée une session HTTP avec retry."""
     session = requests.Session()
@@ -248,8 +259,21 @@ def update_wallet_tokens_in_db(wallet_address, tokens_data):
 
 
 
-def detect_position_changes_sql(wallet_address, current_tokens_data, session_id):
-    """Détecte et enregistre les changements de positions."""
+_SQL_PREVIOUS_POSITIONS = """
+    SELECT t.symbol, t.current_amount, t.current_usd_value,
+           COALESCE(t.current_price_per_token, 0), t.contract_address, t.fungible_id
+    FROM tokens t WHERE t.wallet_address = ? AND t.in_portfolio = 1
+"""
+_SQL_SMART_WALLET_FILTER = """
+    AND EXISTS (SELECT 1 FROM smart_wallets sw WHERE sw.wallet_address = t.wallet_address AND sw.optimal_threshold_tier > 0)
+"""
+
+
+def detect_position_changes_sql(wallet_address, current_tokens_data, session_id, smart_set=None):
+    """Détecte et enregistre les changements de positions.
+
+    `smart_set` (optionnel) évite la sous-requête smart_wallets par wallet.
+    """
     changes = {"new_tokens": [], "accumulations": [], "reductions": [], "exits": []}
     conn = None
     try:
@@ -258,16 +282,19 @@ def detect_position_changes_sql(wallet_address, current_tokens_data, session_id)
         cursor = conn.cursor()
         now = datetime.now().isoformat()
 
-        cursor.execute("""
-            SELECT t.symbol, t.current_amount, t.current_usd_value,
-                   COALESCE(t.current_price_per_token, 0), t.contract_address, t.fungible_id
-            FROM tokens t WHERE t.wallet_address = ? AND t.in_portfolio = 1
-            AND EXISTS (SELECT 1 FROM smart_wallets sw WHERE sw.wallet_address = t.wallet_address AND sw.optimal_threshold_tier > 0)
-        """, (wallet_address,))
+        # Sans smart_set, filtre smart wallets en SQL ; sinon résolu en mémoire
+        if smart_set is None:
+            cursor.execute(_SQL_PREVIOUS_POSITIONS + _SQL_SMART_WALLET_FILTER, (wallet_address,))
+            rows = cursor.fetchall()
+        elif wallet_address in smart_set:
+            cursor.execute(_SQL_PREVIOUS_POSITIONS, (wallet_address,))
+            rows = cursor.fetchall()
+        else:
+            rows = []
 
         previous = {row[0]: {"amount": row[1] or 0, "usd_value": row[2] or 0, "price_per_token": row[3] or 0,
                               "contract_address": row[4] or "", "fungible_id": row[5] or ""}
-                    for row in cursor.fetchall()}
+                    for row in rows}
 
         current = {t["token"]: t for t in current_tokens_data}
         cur_set, prev_set = set(current), set(previous)
@@ -344,7 +371,7 @@ def detect_position_changes_sql(wallet_address, current_tokens_data, session_id)
     return changes
 
 
-def process_wallet_batch_sql(wallets, position_changes_found, session_id):
+def process_wallet_batch_sql(wallets, position_changes_found, session_id, smart_set=None):
     """Traite un batch de wallets."""
     for address in wallets:
         logger.info(f"{address[:12]}...")
@@ -354,7 +381,7 @@ def process_wallet_batch_sql(wallets, position_changes_found, session_id):
             continue
 
         current_tokens_data = df.to_dict('records')
-        changes = detect_position_changes_sql(address, current_tokens_data, session_id)
+        changes = detect_position_changes_sql(address, current_tokens_data, session_id, smart_set=smart_set)
 
         total = sum(len(v) for v in changes.values())
         if total > 0:
@@ -372,17 +399,18 @@ def process_wallet_batch_sql(wallets, position_changes_found, session_id):
 
 def run_live_wallet_changes_tracker():
     """Pipeline principal de tracking des changements de positions."""
-    session_id = str(uuid.uuid4())[:8]
+    session_id = secrets.token_hex(4)
     logger.info(f"TRACKING LIVE — Session {session_id} — {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
 
     smart_wallets = get_smart_wallets_from_db()
+    smart_set = get_smart_wallet_set()
     position_changes_found = {}
     batch_size = _TL["BATCH_SIZE"]
 
     for i in range(0, len(smart_wallets), batch_size):
         batch = smart_wallets[i:i + batch_size]
         logger.info(f"Batch {i // batch_size + 1}/{(len(smart_wallets) + batch_size - 1) // batch_size}")
-        process_wallet_batch_sql(batch, position_changes_found, session_id)
+        process_wallet_batch_sql(batch, position_changes_found, session_id, smart_set=smart_set)
         if i + batch_size < len(smart_wallets):
             time.sleep(_TL["DELAY_BETWEEN_BATCHES"])
 
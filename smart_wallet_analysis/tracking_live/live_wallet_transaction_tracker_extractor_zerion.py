@@ -3,9 +3,12 @@ import time
 import requests
 import pandas as pd
 import sqlite3
-import uuid
+import secrets
+import threading
 from datetime import datetime
+from urllib.parse import parse_qs, urlparse
 from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
 
 from smart_wallet_analysis.config import DB_PATH, ENV_PATH, TRACKING_LIVE
 from smart_wallet_analysis.logger import get_logger
@@ -26,21 +29,38 @@ if not API_KEY_2:
 
 API_KEYS = [API_KEY_1, API_KEY_2]
 api_key_index = 0
+_api_key_lock = threading.Lock()
 
 TRADE_OPS = {'trade', 'swap', 'execute', 'contract_interaction'}
 
+# Session partagée : keep-alive TCP/TLS entre les pages et les tokens
+_session = requests.Session()
+_session.mount("https://", HTTPAdapter(pool_maxsize=4))
+
 
 def get_current_api_key():
     """Retourne la clé API active."""
     return API_KEYS[api_key_index]
 
 
-def rotate_api_key():
-    """Bascule vers la clé API suivante."""
+def rotate_api_key(failed_key=None):
+    """Bascule vers la clé API suivante ; sans effet si failed_key n'est plus la clé active."""
     global api_key_index
-    api_key_index = (api_key_index + 1) % len(API_KEYS)
-    logger.info(f"Rotation vers clé API {api_key_index + 1}")
-    return API_KEYS[api_key_index]
+    with _api_key_lock:
+        if failed_key is not None and failed_key != API_KEYS[api_key_index]:
+            return API_KEYS[api_key_index]
+        api_key_index = (api_key_index + 1) % len(API_KEYS)
+        index = api_key_index
+    logger.info(f"Rotation vers clé API {index + 1}")
+    return API_KEYS[index]
+
+
+def _connect():
+    """Connexion d'écriture : WAL + synchronous=NORMAL (pas de fsync à chaque commit)."""
+    conn = sqlite3.connect(DB_PATH, timeout=30.0)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
 
 
 def get_wallets_with_recent_changes(hours=24):
@@ -76,22 +96,31 @@ def _get_known_hashes(wallet_address, fungible_id):
         return set()
 
 
-def get_token_transaction_history_zerion_full(wallet_address, fungible_id, retries=None):
-    """Récupère l'historique complet Zerion d'un token."""
+def get_token_transaction_history_zerion_full(wallet_address, fungible_id, retries=None,
+                                              reserve_key=None, throttle_key=None):
+    """Récupère l'historique complet Zerion d'un token.
+
+    reserve_key() / throttle_key(key, response) : pacing par clé fourni par l'appelant
+    (fetchs parallèles) ; sans eux, clé active globale et rotation sur 429.
+    """
     retries = _TL["TX_RETRIES"] if retries is None else retries
     known_hashes = _get_known_hashes(wallet_address, fungible_id)
-    headers = {"accept": "application/json", "authorization": f"Basic {get_current_api_key()}"}
     all_transactions, seen_hashes = [], set()
     page_cursor = None
 
     while True:
-        url = f"https://api.zerion.io/v1/wallets/{wallet_address}/transactions/?filter[fungible_ids]={fungible_id}&currency=usd&page[size]={_TL['TX_PAGE_SIZE']}"
+        url = f"https://api.zerion.io/v1/wallets/{wallet_address}/transactions/"
+        params = {"filter[fungible_ids]": fungible_id, "currency": "usd", "page[size]": _TL["TX_PAGE_SIZE"]}
         if page_cursor:
-            url += f"&page[after]={page_cursor}"
+            params["page[after]"] = page_cursor
 
         for attempt in range(retries):
+            key = reserve_key() if reserve_key else get_current_api_key()
+            headers = {"accept": "application/json", "authorization": f"Basic {key}"}
             try:
-                response = requests.get(url, headers=headers, timeout=_TL["TX_HTTP_TIMEOUT_SECONDS"])
+                response = _session.get(url, params=params, headers=headers, timeout=_TL["TX_HTTP_TIMEOUT_SECONDS"])
+                if response.status_code == 429 and throttle_key:
+                    throttle_key(key, response)
                 response.raise_for_status()
                 data = response.json()
                 transactions = data.get("data", [])
@@ -117,11 +146,9 @@ def get_token_transaction_history_zerion_full(wallet_address, fungible_id, retri
                 if not next_url:
                     return all_transactions
 
-                if "page%5Bafter%5D=" in next_url:
-                    page_cursor = next_url.split("page%5Bafter%5D=")[1].split("&")[0]
-                elif "page[after]=" in next_url:
-                    page_cursor = next_url.split("page[after]=")[1].split("&")[0]
-                else:
+                # parse_qs décode page%5Bafter%5D comme page[after]
+                page_cursor = parse_qs(urlparse(next_url).query).get("page[after]", [None])[0]
+                if not page_cursor:
                     return all_transactions
 
                 time.sleep(_TL["TX_PAGE_DELAY_SECONDS"])
@@ -132,9 +159,13 @@ def get_token_transaction_history_zerion_full(wallet_address, fungible_id, retri
                     time.sleep(_TL["TX_RETRY_DELAY_SECONDS"])
                 else:
                     if "429" in str(e) or "rate limit" in str(e).lower():
-                        rotate_api_key()
-                        time.sleep(_TL["TX_RATE_LIMIT_SLEEP_SECONDS"])
-                        return get_token_transaction_history_zerion_full(wallet_address, fungible_id, retries)
+                        # Avec reserve_key, la clé throttlée est déjà écartée par le pacing de l'appelant
+                        if reserve_key is None:
+                            rotate_api_key(key)
+                            time.sleep(_TL["TX_RATE_LIMIT_SLEEP_SECONDS"])
+                        return get_token_transaction_history_zerion_full(
+                            wallet_address, fungible_id, retries, reserve_key, throttle_key
+                        )
                     logger.error(f"Erreur pagination: {e}")
                     return []
 
@@ -217,8 +248,7 @@ def analyze_and_store_complete_transactions(session_id, wallet_address, token_sy
 
     conn = None
     try:
-        conn = sqlite3.connect(DB_PATH, timeout=30.0)
-        conn.execute("PRAGMA journal_mode=WAL")
+        conn = _connect()
         cursor = conn.cursor()
         for tx in formatted:
             cursor.execute("""
@@ -250,8 +280,7 @@ def clean_processed_change(wallet_address, token_symbol):
     """Supprime les changements traités de wallet_position_changes."""
     conn = None
     try:
-        conn = sqlite3.connect(DB_PATH, timeout=30.0)
-        conn.execute("PRAGMA journal_mode=WAL")
+        conn = _connect()
         cursor = conn.cursor()
         cursor.execute("DELETE FROM wallet_position_changes WHERE wallet_address = ? AND symbol = ?",
                        (wallet_address, token_symbol))
@@ -294,7 +323,7 @@ def replace_complete_token_history(wallet_address, session_id, tokens_to_track):
 
 def run_optimized_transaction_tracking(min_usd=500, hours_lookback=24):
     """Mise à jour des transactions pour wallets avec changements récents."""
-    session_id = str(uuid.uuid4())[:8]
+    session_id = secrets.token_hex(4)
     logger.info(f"TRACKING TRANSACTIONS — Session {session_id} ({hours_lookback}h, min ${min_usd})")
 
     wallets_with_changes = get_wallets_with_recent_changes(hours_lookback)
@@ -330,8 +359,7 @@ def run_optimized_transaction_tracking(min_usd=500, hours_lookback=24):
 
     conn = None
     try:
-        conn = sqlite3.connect(DB_PATH, timeout=30.0)
-        conn.execute("PRAGMA journal_mode=WAL")
+        conn = _connect()
         cursor = conn.cursor()
         cursor.execute("DELETE FROM wallet_position_changes")
         deleted = cursor.rowcount
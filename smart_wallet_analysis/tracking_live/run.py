@@ -4,13 +4,14 @@
 import sys
 import argparse
 import time
-import uuid
+import secrets
 
 from smart_wallet_analysis.config import TRACKING_LIVE
 from smart_wallet_analysis.logger import get_logger
 from smart_wallet_analysis.tracking_live.live_wallet_balances_extractor_zerion import (
     run_live_wallet_changes_tracker,
     get_existing_wallet_tokens,
+    get_smart_wallet_set,
     get_token_balances_zerion,
     detect_position_changes_sql
 )
@@ -21,6 +22,14 @@ logger = get_logger("tracking_live.runner")
 _TL = TRACKING_LIVE
 
 
+def _positions_fingerprint(positions):
+    """Empreinte (contrat, quantité arrondie) d'un ensemble de positions."""
+    return frozenset(
+        ((p.get('contract_address') or '').lower(), round(p.get('amount') or 0, 6))
+        for p in positions
+    )
+
+
 def run_complete_live_tracking(enable_transaction_tracking=True, min_usd=None, hours_lookback=None):
     """Lance le tracking live complet."""
     min_usd = _TL["MIN_TOKEN_VALUE_USD"] if min_usd is None else min_usd
@@ -82,7 +91,9 @@ def run_rescoring_transaction_update(wallet_list, min_usd=None, hours_lookback=N
     hours_lookback = _TL["HOURS_LOOKBACK_DEFAULT"] if hours_lookback is None else hours_lookback
     logger.info(f"MISE À JOUR RE-SCORING — {len(wallet_list)} wallets")
     start_time = time.time()
-    session_id = str(uuid.uuid4())[:8]
+    # Identifiant de session purement informatif (pas d'usage cryptographique)
+    session_id = secrets.token_hex(4)
+    smart_set = get_smart_wallet_set()
     changes_detected = errors = 0
 
     for i, wallet in enumerate(wallet_list, 1):
@@ -111,7 +122,11 @@ def run_rescoring_transaction_update(wallet_list, min_usd=None, hours_lookback=N
                 for _, row in live_df.iterrows()
             ]
 
-            changes = detect_position_changes_sql(wallet, live_positions, session_id)
+            if _positions_fingerprint(db_positions.values()) == _positions_fingerprint(live_positions):
+                logger.info("  Aucun changement (positions identiques)")
+                continue
+
+            changes = detect_position_changes_sql(wallet, live_positions, session_id, smart_set=smart_set)
             total = sum(len(changes.get(k, [])) for k in ('new_tokens', 'accumulations', 'reductions', 'exits')) if changes else 0
             if total > 0:
                 changes_detected += 1
@@ -156,17 +171,25 @@ def main():
     )
     args = parser.parse_args()
 
+    if args.balance_only or args.no_transactions:
+        mode = "balance"
+    elif args.transactions_only:
+        mode = "transactions"
+    else:
+        mode = "complete"
+
+    dispatch = {
+        "balance": lambda a: run_balance_tracking_only(),
+        "transactions": lambda a: run_transaction_tracking_only(min_usd=a.min_usd, hours_lookback=a.hours_lookback),
+        "complete": lambda a: run_complete_live_tracking(
+            enable_transaction_tracking=True,
+            min_usd=a.min_usd,
+            hours_lookback=a.hours_lookback
+        ),
+    }
+
     try:
-        if args.balance_only or args.no_transactions:
-            success = run_balance_tracking_only()
-        elif args.transactions_only:
-            success = run_transaction_tracking_only(min_usd=args.min_usd, hours_lookback=args.hours_lookback)
-        else:
-            success = run_complete_live_tracking(
-                enable_transaction_tracking=True,
-                min_usd=args.min_usd,
-                hours_lookback=args.hours_lookback
-            )
+        success = dispatch[mode](args)
         sys.exit(0 if success else 1)
 
     except KeyboardInterrupt:
@@ -2,16 +2,22 @@
 """Détecteur de migrations de wallets."""
 
 import sqlite3
-import json
+import functools
 import os
 import time
-import uuid
+import secrets
+import threading
 import requests
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, timezone, timedelta
-import pandas as pd
+from operator import itemgetter
 from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 from smart_wallet_analysis.config import DB_PATH, ENV_PATH, MIGRATION_DETECTOR
+from smart_wallet_analysis.json_utils import dumps, loads
 from smart_wallet_analysis.logger import get_logger
 from smart_wallet_analysis.token_discovery_manual.smart_contrat_remover import ContractChecker
 from smart_wallet_analysis.tracking_live.live_wallet_transaction_tracker_extractor_zerion import (
@@ -25,87 +31,165 @@ logger = get_logger("tracking_live.migration")
 
 _MD = MIGRATION_DETECTOR
 
-API_KEYS = [k for k in [os.getenv("ZERION_API_KEY"), os.getenv("ZERION_API_KEY_2")] if k]
-_api_index = 0
-
-_contract_checker = ContractChecker()
-
-
-def _get_api_key():
-    """Retourne la clé API active."""
-    return API_KEYS[_api_index]
-
+# Requêtes du chemin d'écriture d'une migration : littéraux uniques, réutilisés par le cache
+# de statements préparés de la connexion
+_SQL_INSERT_FILS_WALLET = """
+    INSERT OR IGNORE INTO wallets (
+        wallet_address, period, is_active, is_scored,
+        transactions_extracted, total_portfolio_value,
+        created_at, updated_at
+    ) VALUES (?, 'migration', 1, 0, 0, 0, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)
+"""
+_SQL_MARK_FILS_EXTRACTED = (
+    "UPDATE wallets SET transactions_extracted = 1, updated_at = CURRENT_TIMESTAMP WHERE wallet_address = ?"
+)
+_SQL_PARENT_BUY_PRICES = """
+    SELECT symbol, SUM(ABS(quantity) * price_per_token) / SUM(ABS(quantity)) AS price
+    FROM transaction_history
+    WHERE wallet_address = ? AND action_type = 'buy'
+    AND price_per_token > 0 AND quantity != 0
+    AND symbol IN (SELECT symbol FROM _inherit_symbols)
+    GROUP BY symbol
+    HAVING price > 0
+"""
+_SQL_INHERIT_PRICE = """
+    UPDATE transaction_history
+    SET inherited_price_per_token = ?, is_inherited_from_wallet = ?
+    WHERE wallet_address = ? AND symbol = ? AND direction = 'in'
+    AND inherited_price_per_token IS NULL
+"""
+_SQL_SAVE_MIGRATION = """
+    INSERT OR IGNORE INTO wallet_migrations (
+        old_wallet, new_wallet, migration_date, migration_ts,
+        tokens_transferred, total_value_transferred,
+        transfer_percentage, is_validated
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, 1)
+"""
 
-def _rotate_api_key():
-    """Bascule vers la clé API suivante."""
-    global _api_index
-    _api_index = (_api_index + 1) % len(API_KEYS)
+API_KEYS = [k for k in [os.getenv("ZERION_API_KEY"), os.getenv("ZERION_API_KEY_2")] if k]
+# Prochain créneau libre par clé (time.monotonic) ; choix et réservation sous _key_lock
+_key_next_ok = {key: 0.0 for key in API_KEYS}
+_key_lock = threading.Lock()
+# Header d'authentification préformaté par clé (ne pas muter : partagé entre threads)
+_AUTH_HEADERS = {key: {"authorization": f"Basic {key}"} for key in API_KEYS}
+
+_contract_cache = {}
+
+
+@functools.cache
+def _get_contract_checker():
+    """ContractChecker instancié au premier usage (pas de session HTTP à l'import)."""
+    return ContractChecker()
+
+
+def _reserve_key():
+    """Réserve le créneau le plus proche parmi les clés API, attend ce créneau et retourne la clé.
+
+    Choix et réservation se font sous un seul verrou ; l'attente et la requête HTTP hors verrou,
+    pour que plusieurs requêtes soient en vol tout en respectant l'intervalle de chaque clé.
+    """
+    with _key_lock:
+        key = min(API_KEYS, key=_key_next_ok.__getitem__)
+        slot = max(_key_next_ok[key], time.monotonic())
+        _key_next_ok[key] = slot + _MD["KEY_MIN_INTERVAL_SECONDS"]
+    delay = slot - time.monotonic()
+    if delay > 0:
+        time.sleep(delay)
+    return key
+
+
+def _throttle_key(key, response):
+    """Met une clé en pause après un 429, selon Retry-After si présent."""
+    try:
+        retry_after = float(response.headers.get("Retry-After", ""))
+    except ValueError:
+        retry_after = _MD["RATE_LIMIT_SLEEP_SECONDS"]
+    with _key_lock:
+        _key_next_ok[key] = max(_key_next_ok[key], time.monotonic() + retry_after)
+
+
+def _contract_status_cached(addresses):
+    """is_contract_batch mémoïsé ; les erreurs (None) ne sont pas mises en cache."""
+    addresses = {address.lower() for address in addresses}
+    missing = [address for address in addresses if address not in _contract_cache]
+    if missing:
+        for address, result in _get_contract_checker().is_contract_batch(missing).items():
+            if result is not None:
+                _contract_cache[address] = result
+    return {address: _contract_cache.get(address) for address in addresses}
+
+
+def _create_http_session():
+    """Crée la session HTTP partagée (keep-alive, pool de connexions, retry)."""
+    session = requests.Session()
+    session.headers.update({"accept": "application/json"})
+    retry = Retry(
+        total=_MD["RETRIES"],
+        backoff_factor=_MD["HTTP_RETRY_BACKOFF"],
+        status_forcelist=_MD["HTTP_RETRY_STATUS"],
+        allowed_methods=("GET",),
+        respect_retry_after_header=True,
+        raise_on_status=False
+    )
+    adapter = HTTPAdapter(pool_connections=_MD["HTTP_POOL_SIZE"], pool_maxsize=_MD["HTTP_POOL_SIZE"], max_retries=retry)
+    session.mount("https://", adapter)
+    return session
 
 
-def _zerion_headers():
-    """Construit les headers Zerion."""
-    return {"accept": "application/json", "authorization": f"Basic {_get_api_key()}"}
+_session = _create_http_session()
 
 
-def fetch_recent_transactions(wallet_address, hours_lookback=None, retries=None):
+def fetch_recent_transactions(wallet_address, hours_lookback=None):
     """Récupère les transactions send du wallet mère sur la période."""
     hours_lookback = _MD["HOURS_LOOKBACK"] if hours_lookback is None else hours_lookback
-    retries = _MD["RETRIES"] if retries is None else retries
 
-    url = (
+    page_url = (
         f"https://api.zerion.io/v1/wallets/{wallet_address}/transactions/"
         f"?filter[operation_types]=send&currency=usd&page[size]=100"
     )
-    all_transactions, page_cursor, page_count = [], None, 0
+    all_transactions, page_count, rate_limit_hits = [], 0, 0
+    # mined_at est en ISO-8601 UTC (…Z) : l'ordre lexicographique suit l'ordre chronologique
+    cutoff_str = (datetime.now(timezone.utc) - timedelta(hours=hours_lookback)).strftime("%Y-%m-%dT%H:%M:%S")
 
     while page_count < _MD["MAX_PAGES"]:
-        paginated_url = url + (f"&page[after]={page_cursor}" if page_cursor else "")
-
-        for attempt in range(retries):
-            try:
-                response = requests.get(paginated_url, headers=_zerion_headers(), timeout=15)
-
-                if response.status_code == 429:
-                    _rotate_api_key()
-                    time.sleep(_MD["RATE_LIMIT_SLEEP_SECONDS"])
-                    continue
-
-                response.raise_for_status()
-                data = response.json()
-                transactions = data.get("data", [])
-                page_count += 1
+        try:
+            key = _reserve_key()
+            response = _session.get(page_url, headers=_AUTH_HEADERS[key], timeout=_MD["HTTP_TIMEOUT_SECONDS"])
+            if response.status_code == 429:
+                _throttle_key(key, response)
+
+            # Clé en pause : la requête repart sur la clé disponible le plus tôt
+            if response.status_code == 429 and rate_limit_hits < _MD["RETRIES"] * len(API_KEYS):
+                rate_limit_hits += 1
+                continue
 
-                if not transactions:
-                    return all_transactions
+            response.raise_for_status()
+            data = response.json()
+        except Exception as e:
+            logger.error(f"Erreur Zerion {wallet_address[:10]}...: {e}")
+            return all_transactions
 
-                all_transactions.extend(transactions)
+        transactions = data.get("data", [])
+        page_count += 1
 
-                oldest_date_str = transactions[-1].get("attributes", {}).get("mined_at", "")
-                if oldest_date_str:
-                    oldest_dt = datetime.fromisoformat(oldest_date_str.replace("Z", "+00:00"))
-                    if oldest_dt < datetime.now(timezone.utc) - timedelta(hours=hours_lookback):
-                        return all_transactions
+        if not transactions:
+            return all_transactions
 
-                next_url = data.get("links", {}).get("next")
-                if not next_url:
-                    return all_transactions
+        oldest_date_str = transactions[-1].get("attributes", {}).get("mined_at", "")
+        if oldest_date_str and oldest_date_str < cutoff_str:
+            # Dernière page utile : on ne garde que la partie dans la fenêtre (tri décroissant)
+            for tx in transactions:
+                mined_at = tx.get("attributes", {}).get("mined_at", "")
+                if not mined_at or mined_at >= cutoff_str:
+                    all_transactions.append(tx)
+            return all_transactions
 
-                if "page%5Bafter%5D=" in next_url:
-                    page_cursor = next_url.split("page%5Bafter%5D=")[1].split("&")[0]
-                elif "page[after]=" in next_url:
-                    page_cursor = next_url.split("page[after]=")[1].split("&")[0]
-                else:
-                    return all_transactions
+        all_transactions.extend(transactions)
 
-                time.sleep(_MD["PAGE_DELAY_SECONDS"])
-                break
-
-            except Exception as e:
-                if attempt < retries - 1:
-                    time.sleep(_MD["RETRY_DELAY_SECONDS"])
-                else:
-                    logger.error(f"Erreur Zerion {wallet_address[:10]}...: {e}")
-                    return all_transactions
+        # Le curseur est porté tel quel par links.next
+        page_url = data.get("links", {}).get("next")
+        if not page_url:
+            return all_transactions
 
     return all_transactions
 
@@ -118,54 +202,158 @@ def analyze_transfers_for_migration(transactions, portfolio_value, min_transfer_
     if portfolio_value <= 0:
         return None
 
-    cutoff = datetime.now(timezone.utc) - timedelta(days=max_days)
-    dest_value, dest_tokens = {}, {}
+    cutoff_str = (datetime.now(timezone.utc) - timedelta(days=max_days)).strftime("%Y-%m-%dT%H:%M:%S")
+
+    # Passe 1 : somme des valeurs sortantes par destination (seuls les floats sont accumulés)
+    dest_value = defaultdict(float)
+    outgoing = []  # (recipient, value, transfer)
 
     for tx in transactions:
-        tx_date_str = tx.get("attributes", {}).get("mined_at", "")
-        if tx_date_str and datetime.fromisoformat(tx_date_str.replace("Z", "+00:00")) < cutoff:
-            continue
+        attrs = tx.get("attributes", {})
+        tx_date_str = attrs.get("mined_at", "")
+        if tx_date_str and tx_date_str < cutoff_str:
+            # Zerion renvoie les transactions de la plus récente à la plus ancienne
+            break
 
-        for transfer in tx.get("attributes", {}).get("transfers", []):
+        for transfer in attrs.get("transfers", []):
             if transfer.get("direction") != "out":
                 continue
             recipient = transfer.get("recipient")
-            if not recipient:
+            value = transfer.get("value")
+            if not recipient or value is None:
+                continue
+            try:
+                value = float(value)
+            except (TypeError, ValueError):
                 continue
-            value = float(transfer.get("value") or 0)
             if value <= 0:
                 continue
+            dest_value[recipient] += value
+            outgoing.append((recipient, value, transfer))
 
-            finfo = transfer.get("fungible_info") or {}
-            symbol = (finfo.get("symbol") or "UNKNOWN").upper()
+    if not dest_value:
+        return None
+
+    top_dest, top_value = max(dest_value.items(), key=itemgetter(1))
+    pct = (top_value / portfolio_value) * 100
+    if pct < min_transfer_pct:
+        return None
+
+    # Passe 2 : détail des tokens uniquement pour la destination retenue
+    tokens = {}
+    for recipient, value, transfer in outgoing:
+        if recipient != top_dest:
+            continue
+        finfo = transfer.get("fungible_info") or {}
+        fungible_id = finfo.get("id")
+        try:
+            quantity = float(transfer["quantity"]["numeric"])
+        except (KeyError, TypeError, ValueError):
+            quantity = 0.0
+
+        entry = tokens.get(fungible_id) if fungible_id else None
+        if entry is None:
             impls = finfo.get("implementations") or []
+            symbol = (finfo.get("symbol") or "UNKNOWN").upper()
             contract_address = impls[0].get("address") if impls else None
-            qty_data = transfer.get("quantity") or {}
-            quantity = float(qty_data.get("numeric", 0)) if isinstance(qty_data, dict) else 0
-
-            dest_value[recipient] = dest_value.get(recipient, 0) + value
-            dest_tokens.setdefault(recipient, []).append({
+            key = fungible_id or (symbol, contract_address)
+            entry = tokens.get(key)
+        if entry is None:
+            tokens[key] = {
                 "symbol": symbol,
                 "contract_address": contract_address,
-                "fungible_id": finfo.get("id"),
+                "fungible_id": fungible_id,
                 "quantity_transferred": quantity,
                 "value_usd": value
-            })
-
-    if not dest_value:
-        return None
-
-    top_dest = max(dest_value, key=dest_value.get)
-    pct = (dest_value[top_dest] / portfolio_value) * 100
+            }
+        else:
+            entry["quantity_transferred"] += quantity
+            entry["value_usd"] += value
 
-    if pct >= min_transfer_pct:
-        return {"destination": top_dest, "total_value": dest_value[top_dest], "transfer_percentage": pct, "tokens_data": dest_tokens[top_dest]}
-    return None
+    return {"destination": top_dest, "total_value": top_value, "transfer_percentage": pct, "tokens_data": list(tokens.values())}
 
 
 class WalletMigrationDetector:
     def __init__(self, db_path=DB_PATH):
         self.db_path = db_path
+        # Autocommit : les écritures d'une migration sont regroupées via BEGIN IMMEDIATE … COMMIT
+        self._conn = sqlite3.connect(self.db_path, timeout=30.0, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA temp_store=MEMORY")
+        self._conn.execute("PRAGMA cache_size=-65536")
+        self._conn.execute("PRAGMA mmap_size=268435456")
+        self._ensure_migration_ts_column()
+        self._ensure_eoa_cache_table()
+        self._ensure_indexes()
+
+    def _ensure_migration_ts_column(self):
+        """Ajoute wallet_migrations.migration_ts (epoch UTC, secondes) et rétro-remplit l'existant."""
+        try:
+            columns = {row[1] for row in self._conn.execute("PRAGMA table_info(wallet_migrations)")}
+            if not columns or "migration_ts" in columns:
+                return
+            self._conn.execute("ALTER TABLE wallet_migrations ADD COLUMN migration_ts INTEGER")
+            self._conn.execute(
+                "UPDATE wallet_migrations SET migration_ts = CAST(strftime('%s', migration_date) AS INTEGER) "
+                "WHERE migration_ts IS NULL"
+            )
+            logger.info("Colonne wallet_migrations.migration_ts ajoutée")
+        except sqlite3.Error as e:
+            logger.warning(f"Ajout de migration_ts impossible: {e}")
+
+    def _ensure_eoa_cache_table(self):
+        """Crée le cache persistant des statuts EOA/contrat des destinations."""
+        try:
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS known_eoa_cache (
+                    address TEXT PRIMARY KEY,
+                    is_contract INTEGER NOT NULL,
+                    checked_at INTEGER NOT NULL
+                ) WITHOUT ROWID
+            """)
+        except sqlite3.Error as e:
+            logger.warning(f"Création de known_eoa_cache impossible: {e}")
+
+    def _ensure_indexes(self):
+        """Crée les index utilisés par l'héritage de prix et la chaîne de migrations."""
+        indexes = {
+            "idx_th_wallet_symbol_action": (
+                "CREATE INDEX IF NOT EXISTS idx_th_wallet_symbol_action "
+                "ON transaction_history(wallet_address, symbol, action_type) WHERE price_per_token > 0"
+            ),
+            "idx_th_wallet_symbol_dir_inh": (
+                "CREATE INDEX IF NOT EXISTS idx_th_wallet_symbol_dir_inh "
+                "ON transaction_history(wallet_address, symbol, direction) WHERE inherited_price_per_token IS NULL"
+            ),
+            "idx_wm_old_new": (
+                "CREATE INDEX IF NOT EXISTS idx_wm_old_new "
+                "ON wallet_migrations(old_wallet, new_wallet, migration_date)"
+            ),
+            "idx_wm_new_wallet": (
+                "CREATE INDEX IF NOT EXISTS idx_wm_new_wallet ON wallet_migrations(new_wallet)"
+            ),
+        }
+        try:
+            schema = self._conn.execute(
+                "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'wallet_migrations'"
+            ).fetchone()
+            if schema and "WITHOUT ROWID" in (schema[0] or "").upper():
+                # La clé primaire (old_wallet, new_wallet, migration_date) couvre déjà cet index
+                del indexes["idx_wm_old_new"]
+            existing = {row[0] for row in self._conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+            missing = [name for name in indexes if name not in existing]
+            for name in missing:
+                self._conn.execute(indexes[name])
+            if missing:
+                self._conn.execute("ANALYZE")
+                logger.info(f"Index créés: {', '.join(missing)}")
+        except sqlite3.Error as e:
+            logger.warning(f"Création des index impossible: {e}")
+
+    def close(self):
+        """Ferme la connexion SQLite persistante."""
+        self._conn.close()
 
     def detect_migrations(self, hours_lookback=None, min_transfer_percentage=None):
         """Détecte et traite les migrations de wallets."""
@@ -176,65 +364,58 @@ class WalletMigrationDetector:
         migrations_detected = []
 
         try:
-            conn = sqlite3.connect(self.db_path)
-            wallets_df = pd.read_sql_query(
+            # Itération directe du curseur : pas de liste intermédiaire de lignes brutes
+            wallets = [(wallet, float(portfolio_value)) for wallet, portfolio_value in self._conn.execute(
                 "SELECT w.wallet_address, w.total_portfolio_value "
                 "FROM wallets w INNER JOIN smart_wallets sw ON w.wallet_address = sw.wallet_address "
-                "WHERE w.is_active = 1 AND w.total_portfolio_value > 0 "
+                "WHERE w.is_active = 1 AND w.total_portfolio_value > :min_portfolio_value "
                 "ORDER BY w.total_portfolio_value DESC",
-                conn
-            )
-            conn.close()
-            logger.info(f"{len(wallets_df)} smart wallets à analyser")
-
-            for _, row in wallets_df.iterrows():
-                wallet = row["wallet_address"]
-                portfolio_value = float(row["total_portfolio_value"] or 0)
-                logger.info(f"[{wallet[:10]}...] portfolio=${portfolio_value:,.0f}")
-
-                transactions = fetch_recent_transactions(wallet, hours_lookback=hours_lookback)
-                if not transactions:
-                    logger.info(f"  Aucune transaction send récente")
-                    time.sleep(_MD["SHORT_SLEEP_SECONDS"])
-                    continue
-                logger.info(f"  {len(transactions)} transactions send récupérées")
-
-                result = analyze_transfers_for_migration(transactions, portfolio_value, min_transfer_pct=min_transfer_percentage)
-                if not result:
-                    logger.info(f"  Seuil non atteint, pas de migration")
-                    time.sleep(_MD["SHORT_SLEEP_SECONDS"])
-                    continue
-
-                destination = result["destination"]
-                total_value = result["total_value"]
-                pct = result["transfer_percentage"]
-                tokens_data = result["tokens_data"]
-                logger.info(f"  Migration: {wallet[:10]}... → {destination[:10]}... ${total_value:,.2f} ({pct:.1f}%) | {len(tokens_data)} tokens")
-
-                is_contract = _contract_checker.is_contract_single(destination)
-                if is_contract is True:
-                    logger.info(f"  Smart contract → ignoré")
-                    time.sleep(_MD["SHORT_SLEEP_SECONDS"])
-                    continue
-                if is_contract is None:
-                    logger.warning(f"  Vérification EOA impossible → ignoré par sécurité")
-                    time.sleep(_MD["SHORT_SLEEP_SECONDS"])
-                    continue
-                logger.info(f"  EOA confirmé")
-
-                conn = sqlite3.connect(self.db_path)
-                self._insert_fils_wallet(conn, destination)
-                session_id = str(uuid.uuid4())[:8]
-                self._fetch_fils_history(conn, destination, tokens_data, session_id)
-                self._inherit_prices(conn, old_wallet=wallet, new_wallet=destination, tokens_data=tokens_data)
-                migration = self._save_migration(conn, old_wallet=wallet, new_wallet=destination,
-                                                 tokens_data=tokens_data, total_value=total_value,
-                                                 transfer_percentage=pct)
-                conn.close()
+                {"min_portfolio_value": max(_MD["MIN_PORTFOLIO_VALUE_USD"], 0)}
+            )]
+            logger.info(f"{len(wallets)} smart wallets à analyser (portfolio > ${_MD['MIN_PORTFOLIO_VALUE_USD']:,})")
+
+            # Étape 1 (parallèle, lecture seule) : fetch Zerion + analyse
+            with ThreadPoolExecutor(max_workers=_MD["MAX_WORKERS"]) as executor:
+                analyzed = [c for c in executor.map(
+                    lambda w: self._discover_candidate(w[0], w[1], hours_lookback, min_transfer_percentage),
+                    wallets
+                ) if c]
+
+            # Vérification EOA groupée des destinations uniques (plusieurs wallets migrent souvent
+            # vers la même adresse)
+            contract_status = self._contract_status(c["destination"] for c in analyzed)
+
+            candidates = [c for c in analyzed if self._is_eoa_destination(c, contract_status[c["destination"].lower()])]
+            logger.info(f"{len(candidates)} migrations candidates validées")
+
+            # Étape 2 (séquentielle) : écritures SQLite
+            for candidate in candidates:
+                wallet = candidate["wallet"]
+                destination = candidate["destination"]
+                tokens_data = candidate["tokens_data"]
+
+                # L'historique fils est écrit par le tracker (connexion dédiée) hors transaction
+                session_id = secrets.token_hex(4)
+                tokens_fetched = self._fetch_fils_history(destination, tokens_data, session_id)
+
+                conn = self._conn
+                try:
+                    conn.execute("BEGIN IMMEDIATE")
+                    self._insert_fils_wallet(conn, destination, transactions_extracted=tokens_fetched > 0)
+                    self._inherit_prices(conn, old_wallet=wallet, new_wallet=destination, tokens_data=tokens_data)
+                    migration = self._save_migration(conn, old_wallet=wallet, new_wallet=destination,
+                                                     tokens_data=tokens_data, total_value=candidate["total_value"],
+                                                     transfer_percentage=candidate["transfer_percentage"])
+                    conn.execute("COMMIT")
+                except Exception as e:
+                    if conn.in_transaction:
+                        conn.execute("ROLLBACK")
+                    logger.error(f"[{wallet[:10]}...] Erreur enregistrement migration: {e}")
+                    migration = None
 
                 if migration:
                     migrations_detected.append(migration)
-                    logger.info(f"  Migration complète enregistrée")
+                    logger.info(f"[{wallet[:10]}...] Migration complète enregistrée")
 
                 time.sleep(_MD["AFTER_MIGRATION_SLEEP_SECONDS"])
 
@@ -245,130 +426,179 @@ class WalletMigrationDetector:
             logger.error(f"Erreur detect_migrations: {e}", exc_info=True)
             return []
 
-    def _insert_fils_wallet(self, conn, fils_address):
-        """Insère le wallet fils dans wallets."""
+    def _discover_candidate(self, wallet, portfolio_value, hours_lookback, min_transfer_percentage):
+        """Analyse un wallet et retourne sa migration candidate, ou None."""
+        tag = f"[{wallet[:10]}...]"
+        try:
+            transactions = fetch_recent_transactions(wallet, hours_lookback=hours_lookback)
+            if not transactions:
+                logger.info(f"{tag} Aucune transaction send récente")
+                return None
+            logger.info(f"{tag} portfolio=${portfolio_value:,.0f} | {len(transactions)} transactions send récupérées")
+
+            result = analyze_transfers_for_migration(transactions, portfolio_value, min_transfer_pct=min_transfer_percentage)
+            if not result:
+                logger.info(f"{tag} Seuil non atteint, pas de migration")
+                return None
+
+            logger.info(f"{tag} Migration: → {result['destination'][:10]}... ${result['total_value']:,.2f} "
+                        f"({result['transfer_percentage']:.1f}%) | {len(result['tokens_data'])} tokens")
+            return {"wallet": wallet, **result}
+        except Exception as e:
+            logger.error(f"{tag} Erreur analyse migration: {e}")
+            return None
+
+    def _contract_status(self, destinations):
+        """Statut contrat des destinations : cache SQLite (TTL), puis RPC pour les adresses manquantes."""
+        destinations = list({address.lower() for address in destinations})
+        if not destinations:
+            return {}
+
+        now = int(time.time())
+        known = {}
+        try:
+            known = {
+                address: bool(is_contract) for address, is_contract in self._conn.execute(
+                    f"SELECT address, is_contract FROM known_eoa_cache "
+                    f"WHERE checked_at >= ? AND address IN ({','.join('?' * len(destinations))})",
+                    (now - _MD["EOA_CACHE_TTL_DAYS"] * 86400, *destinations)
+                )
+            }
+        except sqlite3.Error as e:
+            logger.warning(f"Lecture known_eoa_cache impossible: {e}")
+
+        missing = [address for address in destinations if address not in known]
+        fresh = _contract_status_cached(missing)
+        resolved = [(address, int(is_contract), now) for address, is_contract in fresh.items() if is_contract is not None]
+        if resolved:
+            try:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO known_eoa_cache (address, is_contract, checked_at) VALUES (?, ?, ?)",
+                    resolved
+                )
+            except sqlite3.Error as e:
+                logger.warning(f"Écriture known_eoa_cache impossible: {e}")
+        logger.info(f"Statut contrat: {len(known)} depuis le cache, {len(missing)} vérifiés")
+        return {**known, **fresh}
+
+    @staticmethod
+    def _is_eoa_destination(candidate, is_contract):
+        """Filtre une candidate selon le statut contrat de sa destination."""
+        tag = f"[{candidate['wallet'][:10]}...]"
+        if is_contract is True:
+            logger.info(f"{tag} Smart contract → ignoré")
+            return False
+        if is_contract is None:
+            logger.warning(f"{tag} Vérification EOA impossible → ignoré par sécurité")
+            return False
+        logger.info(f"{tag} EOA confirmé")
+        return True
+
+    def _insert_fils_wallet(self, conn, fils_address, transactions_extracted=False):
+        """Insère le wallet fils dans wallets (sans commit)."""
         cursor = conn.cursor()
-        cursor.execute("""
-            INSERT OR IGNORE INTO wallets (
-                wallet_address, period, is_active, is_scored,
-                transactions_extracted, total_portfolio_value,
-                created_at, updated_at
-            ) VALUES (?, 'migration', 1, 0, 0, 0, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)
-        """, (fils_address,))
-        conn.commit()
+        cursor.execute(_SQL_INSERT_FILS_WALLET, (fils_address,))
         status = "inséré" if cursor.rowcount > 0 else "déjà présent"
         logger.info(f"  Fils {status} dans wallets: {fils_address[:10]}...")
 
-    def _fetch_fils_history(self, conn, fils_address, tokens_data, session_id):
-        """Récupère l'historique complet du wallet fils."""
-        seen = set()
-        unique_tokens = []
-        for t in tokens_data:
-            fid = t.get("fungible_id")
-            if fid and fid not in seen:
-                seen.add(fid)
-                unique_tokens.append(t)
-
-        logger.info(f"  Fetch historique fils: {len(unique_tokens)} tokens")
-        tokens_fetched = 0
-
-        for token in unique_tokens:
-            fungible_id = token.get("fungible_id")
-            symbol = token.get("symbol", "UNKNOWN")
-            if not fungible_id:
-                logger.warning(f"  Skip {symbol}: pas de fungible_id")
-                continue
+        if transactions_extracted:
+            cursor.execute(_SQL_MARK_FILS_EXTRACTED, (fils_address,))
+            logger.info(f"  transactions_extracted = 1 pour {fils_address[:10]}...")
 
-            logger.info(f"  Fetch {symbol} ({fungible_id[:20]}...)")
-            raw_transactions = get_token_transaction_history_zerion_full(fils_address, fungible_id)
-            if raw_transactions:
-                count = analyze_and_store_complete_transactions(
-                    session_id, fils_address, symbol, fungible_id,
-                    token.get("contract_address"), raw_transactions
-                )
-                logger.info(f"  {symbol}: {count} transactions stockées")
-                tokens_fetched += 1
+    def _fetch_fils_history(self, fils_address, tokens_data, session_id):
+        """Récupère l'historique complet du wallet fils et retourne le nombre de tokens récupérés."""
+        logger.info(f"  Fetch historique fils: {len(tokens_data)} tokens")
+        tokens = []
+        for token in tokens_data:
+            if token.get("fungible_id"):
+                tokens.append(token)
             else:
-                logger.warning(f"  {symbol}: aucune transaction trouvée")
+                logger.warning(f"  Skip {token.get('symbol', 'UNKNOWN')}: pas de fungible_id")
 
-            time.sleep(_MD["PAGE_DELAY_SECONDS"])
+        tokens_fetched = 0
+        # Fetch Zerion en parallèle borné, chaque requête sur la clé réservée par _reserve_key ;
+        # le stockage reste sur ce thread (un seul writer SQLite)
+        with ThreadPoolExecutor(max_workers=_MD["FILS_FETCH_CONCURRENCY"]) as executor:
+            futures = {
+                executor.submit(
+                    get_token_transaction_history_zerion_full, fils_address, token["fungible_id"],
+                    reserve_key=_reserve_key, throttle_key=_throttle_key,
+                ): token
+                for token in tokens
+            }
+            for future in as_completed(futures):
+                token = futures[future]
+                symbol = token.get("symbol", "UNKNOWN")
+                try:
+                    raw_transactions = future.result()
+                except Exception as e:
+                    logger.error(f"  {symbol}: erreur fetch historique: {e}")
+                    continue
+                if raw_transactions:
+                    count = analyze_and_store_complete_transactions(
+                        session_id, fils_address, symbol, token["fungible_id"],
+                        token.get("contract_address"), raw_transactions
+                    )
+                    logger.info(f"  {symbol}: {count} transactions stockées")
+                    tokens_fetched += 1
+                else:
+                    logger.warning(f"  {symbol}: aucune transaction trouvée")
 
-        if tokens_fetched > 0:
-            conn.execute(
-                "UPDATE wallets SET transactions_extracted = 1, updated_at = CURRENT_TIMESTAMP WHERE wallet_address = ?",
-                (fils_address,)
-            )
-            conn.commit()
-            logger.info(f"  transactions_extracted = 1 pour {fils_address[:10]}...")
+        return tokens_fetched
 
     def _inherit_prices(self, conn, old_wallet, new_wallet, tokens_data):
         """Injecte les prix d'achat hérités sur le wallet fils."""
+        symbols = {token["symbol"] for token in tokens_data}
+        if not symbols:
+            return
+
         cursor = conn.cursor()
-        inherited = 0
+        cursor.execute("CREATE TEMP TABLE IF NOT EXISTS _inherit_symbols (symbol TEXT PRIMARY KEY)")
+        cursor.execute("DELETE FROM _inherit_symbols")
+        cursor.executemany("INSERT INTO _inherit_symbols (symbol) VALUES (?)", [(symbol,) for symbol in symbols])
 
-        for token in tokens_data:
-            symbol = token["symbol"]
-            cursor.execute("""
-                SELECT SUM(ABS(quantity) * price_per_token) / SUM(ABS(quantity))
-                FROM transaction_history
-                WHERE wallet_address = ? AND symbol = ? AND action_type = 'buy'
-                AND price_per_token > 0 AND quantity != 0
-            """, (old_wallet, symbol))
-            result = cursor.fetchone()
-            original_price = result[0] if result and result[0] else None
-
-            if not original_price:
-                logger.info(f"  Pas de prix achat pour {symbol} chez {old_wallet[:10]}... → skip")
-                continue
+        prices = dict(cursor.execute(_SQL_PARENT_BUY_PRICES, (old_wallet,)).fetchall())
 
-            cursor.execute("""
-                UPDATE transaction_history
-                SET inherited_price_per_token = ?, is_inherited_from_wallet = ?
-                WHERE wallet_address = ? AND symbol = ? AND direction = 'in'
-                AND inherited_price_per_token IS NULL
-            """, (original_price, old_wallet, new_wallet, symbol))
-            rows = cursor.rowcount
-            inherited += rows
-            logger.info(f"  {symbol}: ${original_price:.6f} hérité → {rows} tx mises à jour")
+        for symbol in sorted(symbols - prices.keys()):
+            logger.info(f"  Pas de prix achat pour {symbol} chez {old_wallet[:10]}... → skip")
+        if not prices:
+            return
 
-        conn.commit()
-        logger.info(f"  Total héritage: {inherited} transactions")
+        # Un UPDATE par symbole, chacun servi par idx_th_wallet_symbol_dir_inh
+        cursor.executemany(
+            _SQL_INHERIT_PRICE, [(price, old_wallet, new_wallet, symbol) for symbol, price in prices.items()]
+        )
+        inherited = cursor.rowcount
+        logger.info(f"  Total héritage: {inherited} transactions ({len(prices)} tokens avec prix hérité)")
 
     def _save_migration(self, conn, old_wallet, new_wallet, tokens_data, total_value, transfer_percentage):
-        """Enregistre la migration dans wallet_migrations."""
-        try:
-            migration_date = datetime.utcnow().isoformat()
-            cursor = conn.cursor()
-            cursor.execute("""
-                INSERT OR IGNORE INTO wallet_migrations (
-                    old_wallet, new_wallet, migration_date,
-                    tokens_transferred, total_value_transferred,
-                    transfer_percentage, is_validated
-                ) VALUES (?, ?, ?, ?, ?, ?, 1)
-            """, (old_wallet, new_wallet, migration_date, json.dumps(tokens_data), total_value, transfer_percentage))
-            conn.commit()
-            return {"old_wallet": old_wallet, "new_wallet": new_wallet, "migration_date": migration_date,
-                    "tokens_data": tokens_data, "total_value": total_value, "transfer_percentage": transfer_percentage}
-        except Exception as e:
-            logger.error(f"Erreur _save_migration: {e}")
-            conn.rollback()
-            return None
-
-    def get_wallet_migration_chain(self, wallet_address):
-        """Retourne la chaîne complète de migrations pour un wallet."""
+        """Enregistre la migration dans wallet_migrations (sans commit)."""
+        migration_ts = int(time.time())
+        migration_date = time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(migration_ts))
+        conn.execute(_SQL_SAVE_MIGRATION, (
+            old_wallet, new_wallet, migration_date, migration_ts,
+            dumps(tokens_data), total_value, transfer_percentage
+        ))
+        return {"old_wallet": old_wallet, "new_wallet": new_wallet, "migration_date": migration_date,
+                "tokens_data": tokens_data, "total_value": total_value, "transfer_percentage": transfer_percentage}
+
+    def get_wallet_migration_chain(self, wallet_address, include_tokens=False):
+        """Retourne la chaîne complète de migrations pour un wallet (tokens parsés si include_tokens)."""
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                df = pd.read_sql_query(
-                    "SELECT old_wallet, new_wallet, migration_date, tokens_transferred "
-                    "FROM wallet_migrations WHERE old_wallet = ? OR new_wallet = ? ORDER BY migration_date ASC",
-                    conn, params=[wallet_address, wallet_address]
-                )
-            if df.empty:
+            cursor = self._conn.cursor()
+            cursor.row_factory = sqlite3.Row
+            tokens_column = "COALESCE(NULLIF(tokens_transferred, ''), '[]')" if include_tokens else "NULL"
+            rows = cursor.execute(
+                f"SELECT old_wallet, new_wallet, migration_date, {tokens_column} AS tokens "
+                "FROM wallet_migrations WHERE old_wallet = ? OR new_wallet = ? ORDER BY migration_ts ASC",
+                (wallet_address, wallet_address)
+            ).fetchall()
+            if not rows:
                 return None
             return [{"old_wallet": r["old_wallet"], "new_wallet": r["new_wallet"],
                      "migration_date": r["migration_date"],
-                     "tokens": json.loads(r["tokens_transferred"]) if r["tokens_transferred"] else []}
-                    for _, r in df.iterrows()]
+                     "tokens": loads(r["tokens"]) if include_tokens else None}
+                    for r in rows]
         except Exception as e:
             logger.error(f"Erreur get_wallet_migration_chain: {e}")
             return None
@@ -376,21 +606,15 @@ class WalletMigrationDetector:
     def get_effective_buy_price(self, wallet_address, symbol):
         """Retourne le prix d'achat effectif d'un token."""
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-                cursor.execute("""
-                    SELECT inherited_price_per_token FROM transaction_history
-                    WHERE wallet_address = ? AND symbol = ? AND inherited_price_per_token IS NOT NULL LIMIT 1
-                """, (wallet_address, symbol))
-                result = cursor.fetchone()
-                if result and result[0]:
-                    return result[0]
-                cursor.execute("""
-                    SELECT AVG(price_per_token) FROM transaction_history
-                    WHERE wallet_address = ? AND symbol = ? AND action_type = 'buy'
-                """, (wallet_address, symbol))
-                result = cursor.fetchone()
-                return result[0] if result and result[0] else None
+            result = self._conn.execute("""
+                SELECT COALESCE(
+                    (SELECT NULLIF(inherited_price_per_token, 0) FROM transaction_history
+                     WHERE wallet_address = ?1 AND symbol = ?2 AND inherited_price_per_token IS NOT NULL LIMIT 1),
+                    (SELECT NULLIF(AVG(price_per_token), 0) FROM transaction_history
+                     WHERE wallet_address = ?1 AND symbol = ?2 AND action_type = 'buy')
+                )
+            """, (wallet_address, symbol)).fetchone()
+            return result[0] if result else None
         except Exception as e:
             logger.error(f"Erreur get_effective_buy_price: {e}")
             return None
@@ -399,10 +623,13 @@ class WalletMigrationDetector:
 def run_migration_detection(hours_lookback=None, min_transfer_percentage=None):
     """Lance la détection de migrations."""
     detector = WalletMigrationDetector()
-    migrations = detector.detect_migrations(
-        hours_lookback=hours_lookback,
-        min_transfer_percentage=min_transfer_percentage
-    )
+    try:
+        migrations = detector.detect_migrations(
+            hours_lookback=hours_lookback,
+            min_transfer_percentage=min_transfer_percentage
+        )
+    finally:
+        detector.close()
     if migrations:
         logger.info(f"RÉSUMÉ — {len(migrations)} migrations")
         for i, m in enumerate(migrations, 1):
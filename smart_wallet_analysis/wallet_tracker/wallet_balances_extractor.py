@@ -1,33 +1,133 @@
-import os
+import functools
 import time
 import requests
 import sqlite3
-import pandas as pd
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from itertools import islice
 from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
 
-from db.database_utils import insert_wallet, insert_token, get_wallet
 from smart_wallet_analysis.config import DB_PATH, WALLET_BALANCES, ENV_PATH
+from smart_wallet_analysis.json_utils import loads
 from smart_wallet_analysis.logger import get_logger
+from smart_wallet_analysis.wallet_tracker.zerion_utils import RateLimiter, get_api_manager, retry_delay
 
 load_dotenv(dotenv_path=ENV_PATH)
 
 logger = get_logger("wallet_tracker.balances")
 
 _WB = WALLET_BALANCES
+_EXCLUDED_TOKENS = frozenset(symbol.upper() for symbol in _WB["EXCLUDED_TOKENS"])
+
+# Une session par thread (requests.Session n'est pas garanti thread-safe), toutes montées
+# sur le même adapter : le pool urllib3 est partagé entre threads et entre batches, les
+# connexions TLS vers Zerion survivent donc aux ThreadPoolExecutor successifs.
+_thread_local = threading.local()
+_HTTP_ADAPTER = HTTPAdapter(pool_connections=1, pool_maxsize=max(4, _WB["BATCH_SIZE"]), max_retries=0)
+
+# Cadence globale des lookups fungible_id, partagée par les threads du batch
+_pace_lock = threading.Lock()
+_next_lookup_ts = 0.0
+_lookup_interval = _WB["TOKEN_LOOKUP_DELAY"]
+
+_FUNGIBLE_URL = (
+    "https://api.zerion.io/v1/fungibles/"
+    "?filter[implementation_address]={address}&filter[implementation_chain_id]={chain}"
+)
+_POSITIONS_URL = (
+    "https://api.zerion.io/v1/wallets/{address}/positions/"
+    "?filter[positions]=only_simple&currency=usd&filter[trash]=only_non_trash&sort=value"
+)
+
+# Wallets de wallet_brute pas encore dans wallets ; MAX(temporality) = dernière valeur en ordre d'index
+_SQL_PENDING_WALLETS_PAGE = """
+    SELECT wb.wallet_address, COALESCE(MAX(wb.temporality), 'manual')
+    FROM wallet_brute wb
+    WHERE wb.wallet_address > ?
+      AND NOT EXISTS (SELECT 1 FROM wallets w WHERE w.wallet_address = wb.wallet_address)
+    GROUP BY wb.wallet_address
+    ORDER BY wb.wallet_address
+    LIMIT ?
+"""
+_SQL_COUNT_WALLETS = """
+    SELECT COUNT(*), SUM(EXISTS (SELECT 1 FROM wallets w WHERE w.wallet_address = wb.wallet_address))
+    FROM (SELECT DISTINCT wallet_address FROM wallet_brute) wb
+"""
+_SQL_INSERT_WALLET = """
+    INSERT OR IGNORE INTO wallets (wallet_address, period, total_portfolio_value, token_count, is_active)
+    VALUES (?, ?, ?, ?, TRUE)
+"""
+_SQL_INSERT_TOKEN = """
+    INSERT OR REPLACE INTO tokens
+    (wallet_address, fungible_id, symbol, contract_address, chain,
+     current_amount, current_usd_value, current_price_per_token, transaction_history, in_portfolio)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, '[]', 1)
+"""
+
+# (contract_address minuscule, chain) → fungible_id ; chargé/persisté via fungible_id_cache
+_fungible_cache = {}
+_fungible_cache_new = {}
+_fungible_cache_lock = threading.Lock()
+# Un verrou par clé en cours de lookup : un contrat vu par plusieurs wallets du batch = un seul appel
+_fungible_inflight = {}
 
 
 def _safe_float(value, default=0):
-    """Convertit une valeur en float."""
-    if value is None:
-        return default
-    if isinstance(value, dict):
-        return float(value.get("numeric", default))
+    """Convertit une valeur en float (cas courant : nombre JSON, converti directement)."""
     try:
         return float(value)
     except (TypeError, ValueError):
+        if isinstance(value, dict):
+            return float(value.get("numeric", default))
         return default
 
 
+def _get_session():
+    """Session HTTP du thread courant (connexions TCP/TLS réutilisées entre appels)."""
+    session = getattr(_thread_local, "session", None)
+    if session is None:
+        session = requests.Session()
+        session.headers.update({"accept": "application/json"})
+        session.mount("https://", _HTTP_ADAPTER)
+        _thread_local.session = session
+    return session
+
+
+@functools.lru_cache(maxsize=65536)
+def _is_excluded_symbol(symbol):
+    """Symbole exclu (stables, majors) ; mémoïsé par symbole brut, donc un seul upper() par symbole."""
+    return symbol.upper() in _EXCLUDED_TOKENS
+
+
+def _pace_lookup():
+    """Espace les lookups Zerion de l'intervalle courant, tous threads confondus."""
+    global _next_lookup_ts
+    with _pace_lock:
+        now = time.monotonic()
+        wait = _next_lookup_ts - now
+        _next_lookup_ts = max(now, _next_lookup_ts) + _lookup_interval
+    if wait > 0:
+        time.sleep(wait)
+
+
+def _adapt_lookup_interval(rate_limited):
+    """AIMD : intervalle doublé sur 429, puis réduit par petits pas vers TOKEN_LOOKUP_DELAY."""
+    global _lookup_interval
+    base = _WB["TOKEN_LOOKUP_DELAY"]
+    with _pace_lock:
+        if rate_limited:
+            _lookup_interval = min(_lookup_interval * 2, _WB["RETRY_BACKOFF_CAP_SECONDS"])
+        elif _lookup_interval > base:
+            _lookup_interval = max(base, _lookup_interval - base * 0.1)
+
+
+_LIMITER = RateLimiter(
+    _WB["MAX_REQUESTS_PER_SECOND"],
+    backoff_base=_WB["RETRY_BACKOFF_BASE_SECONDS"], backoff_cap=_WB["RETRY_BACKOFF_CAP_SECONDS"],
+)
+
+
 def _wallet_tag(address: str) -> str:
     """Retourne un identifiant court de wallet pour les logs."""
     if not address:
@@ -51,43 +151,175 @@ def _log_wallet_line(tag: str, status: str, **fields):
     logger.info("[%s] %s%s", tag, status, suffix)
 
 
-class APIKeyManager:
-    """Gestion et rotation des clés API Zerion."""
-    def __init__(self):
-        self.keys = [k for k in [os.getenv("ZERION_API_KEY"), os.getenv("ZERION_API_KEY_2")] if k]
-        if not self.keys:
-            raise ValueError("❌ Aucune clé API Zerion trouvée dans .env")
-        self.current_index = 0
-        self.current_key = self.keys[self.current_index]
+class ZerionKeyAuth(requests.auth.AuthBase):
+    """Auth Basic sur la clé courante ; sur 429, bascule de clé, attend et renvoie (MAX_RETRIES max)."""
+
+    def __call__(self, request):
+        _LIMITER.acquire()
+        request.headers["authorization"] = get_api_manager().get_auth()
+        request.register_hook("response", self._retry_on_rate_limit)
+        return request
+
+    def _retry_on_rate_limit(self, response, **kwargs):
+        manager = get_api_manager()
+        for attempt in range(1, _WB["MAX_RETRIES"] + 1):
+            _LIMITER.observe(response)
+            if response.status_code != 429:
+                break
+            _adapt_lookup_interval(rate_limited=True)
+            # Clé réellement envoyée : un seul thread fait tourner la clé sur un même 429
+            sent_auth = response.request.headers.get("authorization", "")
+            manager.rotate_key(sent_auth.removeprefix("Basic "))
+            time.sleep(retry_delay(
+                response, attempt, _WB["RETRY_BACKOFF_BASE_SECONDS"], _WB["RETRY_BACKOFF_CAP_SECONDS"]
+            ))
+            _LIMITER.acquire()
+
+            response.content  # libère la connexion avant le renvoi
+            response.close()
+            retry = response.request.copy()
+            retry.headers["authorization"] = manager.get_auth()
+            new_response = response.connection.send(retry, **kwargs)
+            new_response.history = response.history + [response]
+            new_response.request = retry
+            response = new_response
+
+        if response.status_code != 429:
+            _adapt_lookup_interval(rate_limited=False)
+        return response
+
+
+_ZERION_AUTH = ZerionKeyAuth()
+
+
+def _connect():
+    """Connexion unique du pipeline : WAL + synchronous=NORMAL, transactions explicites."""
+    conn = sqlite3.connect(str(DB_PATH), timeout=30.0, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute("PRAGMA cache_size=-20000")
+    return conn
+
+
+def _ensure_indexes(conn):
+    """Index couvrant pour iter_wallet_periods (GROUP BY + pages keyset servis par l'index)."""
+    try:
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_wallet_brute_wallet_temporality "
+            "ON wallet_brute(wallet_address, temporality)"
+        )
+    except sqlite3.Error as e:
+        logger.warning(f"Création de l'index wallet_brute impossible: {e}")
 
-    def get_key(self):
-        return self.current_key
 
-    def rotate_key(self):
-        if len(self.keys) <= 1:
-            return False
-        self.current_index = (self.current_index + 1) % len(self.keys)
-        self.current_key = self.keys[self.current_index]
-        logger.info(f"Rotation vers clé API #{self.current_index + 1}")
-        return True
+def load_fungible_cache(conn):
+    """Charge le cache persistant des fungible_id (crée la table au besoin)."""
+    try:
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS fungible_id_cache (
+                contract_address TEXT NOT NULL,
+                chain TEXT NOT NULL,
+                fungible_id TEXT NOT NULL,
+                PRIMARY KEY (contract_address, chain)
+            ) WITHOUT ROWID
+        """)
+        rows = conn.execute("SELECT contract_address, chain, fungible_id FROM fungible_id_cache").fetchall()
+        with _fungible_cache_lock:
+            _fungible_cache.update(((contract, chain), fid) for contract, chain, fid in rows)
+        logger.info(f"{len(rows)} fungible_id en cache")
+    except Exception as e:
+        logger.warning(f"Cache fungible_id indisponible: {e}")
 
 
-api_manager = APIKeyManager()
+def save_fungible_cache(conn):
+    """Persiste les fungible_id découverts pendant le run."""
+    with _fungible_cache_lock:
+        rows = [(contract, chain, fid) for (contract, chain), fid in _fungible_cache_new.items()]
+        _fungible_cache_new.clear()
+    if not rows:
+        return
+    try:
+        conn.execute("BEGIN")
+        conn.executemany(
+            "INSERT OR REPLACE INTO fungible_id_cache (contract_address, chain, fungible_id) VALUES (?, ?, ?)",
+            rows
+        )
+        conn.execute("COMMIT")
+        logger.info(f"{len(rows)} fungible_id ajoutés au cache")
+    except Exception as e:
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        logger.warning(f"Sauvegarde du cache fungible_id impossible: {e}")
 
 
-def get_wallet_period_mapping():
-    """Récupère les wallets depuis la table wallet_brute."""
+def _resolve_fungible_id(position, contract, chain, symbol):
+    """fungible_id d'une position : relation Zerion, puis cache, puis lookup /fungibles/."""
+    fungible_id = ((position.get("relationships", {}).get("fungible") or {}).get("data") or {}).get("id")
+    if not fungible_id and not contract and symbol.upper() == "ETH":
+        return "eth"
+    if not contract or not chain:
+        return fungible_id or ""
+
+    key = (contract.lower(), chain)
+    with _fungible_cache_lock:
+        cached = _fungible_cache.get(key)
+    if cached:
+        return cached
+
+    if fungible_id:
+        _remember_fungible_id(key, fungible_id)
+        return fungible_id
+
+    with _fungible_cache_lock:
+        key_lock = _fungible_inflight.setdefault(key, threading.Lock())
+    with key_lock:
+        with _fungible_cache_lock:
+            cached = _fungible_cache.get(key)
+        if cached:
+            return cached
+        _pace_lookup()
+        fungible_id = get_fungible_id_zerion(contract, chain, symbol)
+        if fungible_id:
+            _remember_fungible_id(key, fungible_id)
+    with _fungible_cache_lock:
+        _fungible_inflight.pop(key, None)
+    return fungible_id
+
+
+def _remember_fungible_id(key, fungible_id):
+    """Ajoute un fungible_id au cache mémoire et à la file de persistance."""
+    with _fungible_cache_lock:
+        _fungible_cache[key] = fungible_id
+        _fungible_cache_new[key] = fungible_id
+
+
+def count_wallets_to_process(conn):
+    """Compte les wallets de wallet_brute et ceux déjà présents dans wallets."""
     try:
-        with sqlite3.connect(str(DB_PATH)) as conn:
-            cursor = conn.cursor()
-            cursor.execute("SELECT DISTINCT wallet_address, temporality FROM wallet_brute ORDER BY wallet_address")
-            results = cursor.fetchall()
-        mapping = {addr: (temp if temp else "manual") for addr, temp in results}
-        logger.info(f"{len(mapping)} wallets récupérés depuis wallet_brute")
-        return mapping
+        total, existing = conn.execute(_SQL_COUNT_WALLETS).fetchone()
+        logger.info(f"{total} wallets récupérés depuis wallet_brute")
+        return total, existing or 0
     except Exception as e:
         logger.error(f"Erreur lecture wallet_brute: {e}")
-        return {}
+        return 0, 0
+
+
+def iter_wallet_periods(conn):
+    """Génère les (wallet, période) de wallet_brute absents de wallets, par pages keyset."""
+    page_size = _WB["WALLET_PAGE_SIZE"]
+    last_address = ""
+    while True:
+        try:
+            # Page lue entièrement avant d'être cédée : aucun curseur ouvert pendant les écritures
+            page = conn.execute(_SQL_PENDING_WALLETS_PAGE, (last_address, page_size)).fetchall()
+        except Exception as e:
+            logger.error(f"Erreur lecture wallet_brute: {e}")
+            return
+        if not page:
+            return
+        yield from page
+        last_address = page[-1][0]
 
 
 def get_fungible_id_zerion(contract_address, chain, token_symbol=""):
@@ -97,18 +329,14 @@ def get_fungible_id_zerion(contract_address, chain, token_symbol=""):
     if not contract_address or not chain:
         return ""
 
-    headers = {"accept": "application/json", "authorization": f"Basic {api_manager.get_key()}"}
-    url = f"https://api.zerion.io/v1/fungibles/?filter[implementation_address]={contract_address.lower()}&filter[implementation_chain_id]={chain}"
+    url = _FUNGIBLE_URL.format(address=contract_address.lower(), chain=chain)
 
     try:
-        response = requests.get(url, headers=headers, timeout=_WB["FUNGIBLE_TIMEOUT_SECONDS"])
+        response = _get_session().get(url, auth=_ZERION_AUTH, timeout=_WB["FUNGIBLE_TIMEOUT_SECONDS"])
         if response.status_code == 429:
-            if api_manager.rotate_key():
-                time.sleep(_WB["RATE_LIMIT_SLEEP_SECONDS"])
-                return get_fungible_id_zerion(contract_address, chain, token_symbol)
             return ""
         response.raise_for_status()
-        fungibles = response.json().get("data", [])
+        fungibles = loads(response.content).get("data", [])
         return fungibles[0].get("id", "") if fungibles else ""
     except Exception as e:
         logger.warning(f"Erreur fungible_id {contract_address}: {e}")
@@ -117,46 +345,46 @@ def get_fungible_id_zerion(contract_address, chain, token_symbol=""):
 
 def get_token_balances_zerion(address):
     """Récupère et filtre les positions d'un wallet via Zerion."""
-    headers = {"accept": "application/json", "authorization": f"Basic {api_manager.get_key()}"}
-    url = f"https://api.zerion.io/v1/wallets/{address}/positions/?filter[positions]=only_simple&currency=usd&filter[trash]=only_non_trash&sort=value"
+    url = _POSITIONS_URL.format(address=address)
     tag = _wallet_tag(address)
 
     try:
-        response = requests.get(url, headers=headers, timeout=_WB["POSITIONS_TIMEOUT_SECONDS"])
+        response = _get_session().get(url, auth=_ZERION_AUTH, timeout=_WB["POSITIONS_TIMEOUT_SECONDS"])
         if response.status_code == 429:
-            if api_manager.rotate_key():
-                time.sleep(_WB["RATE_LIMIT_SLEEP_SECONDS"])
-                return get_token_balances_zerion(address)
-            return pd.DataFrame(), {"status": "SKIP", "reason": "rate_limit_no_spare_key"}
+            return [], {"status": "SKIP", "reason": "rate_limit_no_spare_key"}
         response.raise_for_status()
 
-        all_positions = response.json().get("data", [])
-        total_value = sum(_safe_float(p.get("attributes", {}).get("value")) for p in all_positions)
+        # Une seule passe : total du wallet + classement des positions au-dessus du seuil
+        min_token_value = _WB["MIN_TOKEN_VALUE_USD"]
+        total_value = 0.0
+        valid_positions, excluded_positions = [], []
+        for pos in loads(response.content).get("data", []):
+            attrs = pos["attributes"]
+            value = _safe_float(attrs.get("value"))
+            total_value += value
+            if value >= min_token_value:
+                finfo = attrs.get("fungible_info") or {}
+                entry = (pos, attrs, finfo, value)
+                excluded = _is_excluded_symbol(finfo.get("symbol") or "")
+                (excluded_positions if excluded else valid_positions).append(entry)
 
         if total_value < _WB["MIN_WALLET_VALUE_USD"]:
-            return pd.DataFrame(), {
+            return [], {
                 "status": "SKIP",
                 "reason": "wallet_value_below_min",
                 "wallet_value": _fmt_usd(total_value),
                 "min_wallet_value": _fmt_usd(_WB["MIN_WALLET_VALUE_USD"]),
             }
         if total_value > _WB["MAX_WALLET_VALUE_USD"]:
-            return pd.DataFrame(), {
+            return [], {
                 "status": "SKIP",
                 "reason": "wallet_value_above_max",
                 "wallet_value": _fmt_usd(total_value),
                 "max_wallet_value": _fmt_usd(_WB["MAX_WALLET_VALUE_USD"]),
             }
 
-        valid_positions, excluded_positions = [], []
-        for pos in all_positions:
-            attrs = pos.get("attributes", {})
-            if _safe_float(attrs.get("value")) >= _WB["MIN_TOKEN_VALUE_USD"]:
-                symbol = attrs.get("fungible_info", {}).get("symbol", "").upper()
-                (excluded_positions if symbol in _WB["EXCLUDED_TOKENS"] else valid_positions).append(pos)
-
         if len(valid_positions) < _WB["MIN_TOKENS_PER_WALLET"]:
-            return pd.DataFrame(), {
+            return [], {
                 "status": "SKIP",
                 "reason": "valid_tokens_below_min",
                 "wallet_value": _fmt_usd(total_value),
@@ -167,7 +395,7 @@ def get_token_balances_zerion(address):
 
         all_valid = valid_positions + excluded_positions
         if len(all_valid) > _WB["MAX_TOKENS_PER_WALLET"]:
-            return pd.DataFrame(), {
+            return [], {
                 "status": "SKIP",
                 "reason": "total_tokens_above_max",
                 "wallet_value": _fmt_usd(total_value),
@@ -177,25 +405,24 @@ def get_token_balances_zerion(address):
             }
 
         tokens = []
-        for pos in all_valid:
-            attrs = pos.get("attributes", {})
-            finfo = attrs.get("fungible_info", {})
-            impls = finfo.get("implementations", [])
+        for pos, attrs, finfo, value in all_valid:
+            impls = finfo.get("implementations") or []
             chain = impls[0].get("chain_id", "") if impls else ""
             contract = impls[0].get("address", "") if impls else ""
-            fungible_id = get_fungible_id_zerion(contract, chain, finfo.get("symbol", ""))
-            time.sleep(_WB["TOKEN_LOOKUP_DELAY"])
+            fungible_id = _resolve_fungible_id(pos, contract, chain, finfo.get("symbol", ""))
+            amount = _safe_float(attrs.get("quantity"))
             tokens.append({
                 "token": finfo.get("symbol", "UNKNOWN").strip().upper(),
-                "amount": _safe_float(attrs.get("quantity")),
-                "usd_value": _safe_float(attrs.get("value")),
+                "amount": amount,
+                "usd_value": value,
+                "price": value / amount if amount > 0 else 0,
                 "chain": chain,
                 "contract_address": contract,
                 "contract_decimals": impls[0].get("decimals", "") if impls else "",
                 "fungible_id": fungible_id
             })
 
-        return pd.DataFrame(tokens), {
+        return tokens, {
             "status": "VALID",
             "wallet_value": _fmt_usd(total_value),
             "valid_tokens": len(valid_positions),
@@ -205,10 +432,10 @@ def get_token_balances_zerion(address):
 
     except Exception as e:
         logger.error("Erreur Zerion [%s]: %s", tag, e)
-        return pd.DataFrame(), {"status": "ERROR", "reason": "zerion_request_failed"}
+        return [], {"status": "ERROR", "reason": "zerion_request_failed"}
 
 
-def process_wallet_batch(wallets, wallet_to_period):
+def process_wallet_batch(conn, wallets, wallet_to_period):
     """Traite un batch de wallets : filtre, récupère balances et insère en BDD."""
     stats = {
         "processed": 0,
@@ -216,91 +443,116 @@ def process_wallet_batch(wallets, wallet_to_period):
         "skip_reasons": {},
         "errors": 0,
     }
+    to_fetch = {}
     for address in wallets:
         stats["processed"] += 1
-        tag = _wallet_tag(address)
         periode = wallet_to_period.get(address, "manual")
-        if periode not in _WB["PERIODS"]:
-            periode = "manual"
+        to_fetch[address] = periode if periode in _WB["PERIODS"] else "manual"
+
+    # Appels Zerion en parallèle ; les insertions restent sur ce thread (un seul writer SQLite)
+    with ThreadPoolExecutor(max_workers=max(1, min(len(to_fetch), _WB["BATCH_SIZE"]))) as executor:
+        futures = {executor.submit(get_token_balances_zerion, address): address for address in to_fetch}
+        for future in as_completed(futures):
+            address = futures[future]
+            _store_wallet_balances(conn, address, to_fetch[address], *future.result(), stats)
+    return stats
 
-        if get_wallet(address):
-            reason = "already_in_db"
-            stats["skip_reasons"][reason] = stats["skip_reasons"].get(reason, 0) + 1
-            _log_wallet_line(tag, "SKIP", period=periode, reason=reason)
-            continue
-
-        df, decision = get_token_balances_zerion(address)
-        if df.empty:
-            reason = decision.get("reason", "empty_result")
-            if decision.get("status") == "ERROR":
-                stats["errors"] += 1
-                _log_wallet_line(tag, "ERROR", period=periode, reason=reason)
-            else:
-                stats["skip_reasons"][reason] = stats["skip_reasons"].get(reason, 0) + 1
-                fields = {k: v for k, v in decision.items() if k not in {"status", "reason"}}
-                _log_wallet_line(tag, "SKIP", period=periode, reason=reason, **fields)
-            continue
-
-        _log_wallet_line(
-            tag,
-            "VALID",
-            period=periode,
-            wallet_value=decision.get("wallet_value", "n/a"),
-            valid_tokens=decision.get("valid_tokens", 0),
-            excluded_tokens=decision.get("excluded_tokens", 0),
-            tokens_to_insert=decision.get("tokens_to_insert", 0),
-        )
 
-        total_value = df["usd_value"].sum()
-        if not insert_wallet(address, periode, total_value):
+def _store_wallet_balances(conn, address, periode, tokens, decision, stats):
+    """Insère un wallet et ses tokens selon la décision de get_token_balances_zerion."""
+    tag = _wallet_tag(address)
+    if not tokens:
+        reason = decision.get("reason", "empty_result")
+        if decision.get("status") == "ERROR":
+            stats["errors"] += 1
+            _log_wallet_line(tag, "ERROR", period=periode, reason=reason)
+        else:
+            stats["skip_reasons"][reason] = stats["skip_reasons"].get(reason, 0) + 1
+            fields = {k: v for k, v in decision.items() if k not in {"status", "reason"}}
+            _log_wallet_line(tag, "SKIP", period=periode, reason=reason, **fields)
+        return
+
+    _log_wallet_line(
+        tag,
+        "VALID",
+        period=periode,
+        wallet_value=decision.get("wallet_value", "n/a"),
+        valid_tokens=decision.get("valid_tokens", 0),
+        excluded_tokens=decision.get("excluded_tokens", 0),
+        tokens_to_insert=decision.get("tokens_to_insert", 0),
+    )
+
+    total_value = sum(token["usd_value"] for token in tokens)
+    # Wallet + tokens dans une seule transaction (un commit par wallet)
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        if conn.execute(_SQL_INSERT_WALLET, (address, periode, total_value, 0)).rowcount <= 0:
+            conn.execute("ROLLBACK")
             stats["errors"] += 1
             _log_wallet_line(tag, "ERROR", period=periode, reason="wallet_insert_failed")
-            continue
-
-        tokens_ok = sum(
-            insert_token(
-                wallet_address=address,
-                fungible_id=row['fungible_id'],
-                symbol=row['token'],
-                contract_address=row['contract_address'],
-                chain=row['chain'],
-                amount=row['amount'],
-                usd_value=row['usd_value'],
-                price=row['usd_value'] / row['amount'] if row['amount'] > 0 else 0
-            )
-            for _, row in df.iterrows()
-        )
-        stats["inserted"] += 1
-        _log_wallet_line(
-            tag,
-            "INSERTED",
-            period=periode,
-            wallet_total=_fmt_usd(total_value),
-            tokens_inserted=f"{tokens_ok}/{len(df)}",
-        )
-    return stats
+            return
+        token_rows = [
+            (address, t["fungible_id"], t["token"], t["contract_address"], t["chain"],
+             t["amount"], t["usd_value"], t["price"])
+            for t in tokens
+        ]
+        tokens_ok = conn.executemany(_SQL_INSERT_TOKEN, token_rows).rowcount
+        conn.execute("COMMIT")
+    except sqlite3.Error as e:
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        stats["errors"] += 1
+        logger.error("Erreur insertion [%s]: %s", tag, e)
+        _log_wallet_line(tag, "ERROR", period=periode, reason="wallet_insert_failed")
+        return
+    stats["inserted"] += 1
+    _log_wallet_line(
+        tag,
+        "INSERTED",
+        period=periode,
+        wallet_total=_fmt_usd(total_value),
+        tokens_inserted=f"{tokens_ok}/{len(tokens)}",
+    )
 
 
 def run_wallet_balance_pipeline():
     """Pipeline principal : récupère les wallets depuis wallet_brute et insère en BDD."""
-    wallet_to_period = get_wallet_period_mapping()
-    addresses = list(wallet_to_period.keys())
-    logger.info(f"{len(addresses)} wallets à traiter")
-
+    conn = _connect()
+    try:
+        _run_batches(conn)
+    finally:
+        conn.close()
+
+
+def _run_batches(conn):
+    """Boucle des batches sur la connexion du pipeline."""
+    _ensure_indexes(conn)
+    total, existing = count_wallets_to_process(conn)
+    load_fungible_cache(conn)
+    if existing:
+        logger.info(f"{existing} wallets déjà en base ignorés (already_in_db)")
+    total -= existing
+    logger.info(f"{total} wallets à traiter")
+
+    # Batches tirés à la volée (islice) depuis SQL : pas de mapping complet en mémoire
+    pending = iter_wallet_periods(conn)
     batch_size = _WB["BATCH_SIZE"]
-    total_batches = (len(addresses) + batch_size - 1) // batch_size if addresses else 0
-    for i in range(0, len(addresses), batch_size):
-        batch = addresses[i:i + batch_size]
-        batch_idx = i // batch_size + 1
+    total_batches = (total + batch_size - 1) // batch_size
+    done = 0
+    batch_idx = 0
+    while batch := dict(islice(pending, batch_size)):
+        batch_idx += 1
         logger.info(
             "Batch %s/%s | wallets %s-%s/%s",
             batch_idx,
             total_batches,
-            i + 1,
-            i + len(batch),
-            len(addresses),
+            done + 1,
+            done + len(batch),
+            total,
         )
-        batch_stats = process_wallet_batch(batch, wallet_to_period)
+        batch_stats = process_wallet_batch(conn, list(batch), batch)
+        done += len(batch)
+        save_fungible_cache(conn)
         skips = ", ".join(
             f"{reason}:{count}" for reason, count in sorted(batch_stats["skip_reasons"].items())
         ) or "none"
@@ -312,7 +564,7 @@ def run_wallet_balance_pipeline():
             batch_stats["errors"],
             skips,
         )
-        if i + batch_size < len(addresses):
+        if done < total:
             time.sleep(_WB["DELAY_BETWEEN_BATCHES"])
 
     logger.info("Tous les wallets traités.")
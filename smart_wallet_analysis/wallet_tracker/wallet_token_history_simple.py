@@ -1,14 +1,22 @@
-import os
+import functools
+import queue
+import re
 import time
 import requests
 import sqlite3
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timezone
 from dotenv import load_dotenv
-from typing import List, Dict
+from requests.adapters import HTTPAdapter
+from typing import List, Dict, NamedTuple, Optional
+from urllib.parse import parse_qs, urlparse
 from collections import defaultdict
+from itertools import chain, islice
 
 from smart_wallet_analysis.config import DB_PATH, WALLET_TRACKER, ENV_PATH
+from smart_wallet_analysis.json_utils import loads
 from smart_wallet_analysis.logger import get_logger
+from smart_wallet_analysis.wallet_tracker.zerion_utils import RateLimiter, get_api_manager, retry_delay
 
 load_dotenv(dotenv_path=ENV_PATH)
 
@@ -17,142 +25,280 @@ logger = get_logger("wallet_tracker.history")
 _WT = WALLET_TRACKER
 
 
-class APIKeyManager:
-    """Gestion et rotation des clés API Zerion"""
-    def __init__(self):
-        self.keys = [k for k in [os.getenv("ZERION_API_KEY"), os.getenv("ZERION_API_KEY_2")] if k]
-        if not self.keys:
-            raise ValueError("Aucune clé API Zerion trouvée dans .env")
-        self.current_index = 0
-        self.current_key = self.keys[self.current_index]
+def _substring_re(words, flags=0):
+    """Regex unique 'un des mots en sous-chaîne' ; ne matche rien si la liste est vide"""
+    return re.compile("|".join(map(re.escape, words)) or "(?!)", flags)
+
+
+# Filtres trash compilés une fois : noms insensibles à la casse, symboles déjà en majuscules
+_TRASH_NAME_RE = _substring_re(_WT["TRASH_NAMES"], re.IGNORECASE)
+_TRASH_SYMBOL_RE = _substring_re([k.upper() for k in _WT["TRASH_SYMBOLS"]])
+# operation_type Zerion → famille d'action (lookup en frozenset)
+_TRADE_OPS = frozenset({'trade', 'swap', 'execute', 'contract_interaction'})
+_RECV_OPS = frozenset({'receive', 'mint', 'claim'})
+_SKIP_OPS = frozenset({'approve', 'revoke', 'deploy'})
+# Symbole valide : 1 à 20 caractères alphanumériques au sens de str.isalnum (\w sans '_')
+_SYM_RE = re.compile(r"[^\W_]{1,20}\Z")
+
+# Pool HTTP partagé par toutes les sessions d'extracteur : connexions keep-alive vers Zerion
+# réutilisées d'un wallet à l'autre
+_HTTP_ADAPTER = HTTPAdapter(pool_connections=4, pool_maxsize=8, max_retries=0)
+
+# Cadence globale vers Zerion, partagée par tous les workers de process_all_wallets_from_db
+# (PAGE_DELAY_SECONDS ne rythme que les pages d'un même wallet)
+_LIMITER = RateLimiter(
+    _WT["MAX_REQUESTS_PER_SECOND"],
+    backoff_base=_WT["RETRY_BACKOFF_BASE_SECONDS"], backoff_cap=_WT["RETRY_BACKOFF_CAP_SECONDS"],
+)
+
+# journal_mode=WAL et index d'unicité sont persistants dans le fichier : une seule fois par process
+_db_initialized = False
+
+# Clés de conflit des INSERT OR IGNORE : index UNIQUE créé seulement si aucun ne les couvre déjà
+_UNIQUE_KEYS = (
+    ("transaction_history", ("wallet_address", "hash", "fungible_id"), "ix_txh_wallet_hash_fid"),
+    ("tokens", ("wallet_address", "fungible_id"), "ix_tokens_wallet_fid"),
+)
+
+_SQL_MARK_WALLET_PROCESSED = "UPDATE wallets SET transactions_extracted = 1, last_sync = CURRENT_TIMESTAMP WHERE wallet_address = ?"
+_SQL_INSERT_TOKEN = """
+    INSERT OR IGNORE INTO tokens (wallet_address, fungible_id, symbol, contract_address, chain, in_portfolio, created_at, updated_at)
+    VALUES (?, ?, ?, ?, 'ethereum', 0, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)
+"""
+_SQL_INSERT_TRANSACTION_HEAD = """
+    INSERT OR IGNORE INTO transaction_history (
+        wallet_address, fungible_id, symbol, date, hash,
+        operation_type, action_type, swap_description, contract_address,
+        quantity, price_per_token, total_value_usd, direction
+    ) VALUES """
+_SQL_TRANSACTION_VALUES = "(?, ?, ?, ?, ?, ?, ?, NULL, ?, ?, ?, ?, ?)"
+# INSERT multi-lignes : 12 paramètres par ligne, sous la limite historique de 999 variables SQLite
+_TX_ROWS_PER_INSERT = 999 // 12
+
+
+class TxRecord(NamedTuple):
+    """Mouvement d'un token dans une transaction (stockage tuple, pas de dict par ligne)"""
+    transaction_hash: str
+    date: datetime
+    direction: str
+    action_type: str
+    quantity: float
+    price_per_token: float
+    value_usd: float
+    operation_type: str
+
+
+def _ensure_unique_keys(conn: sqlite3.Connection):
+    """Garantit un index UNIQUE sur les clés de conflit (bases créées sans la contrainte)"""
+    for table, columns, index_name in _UNIQUE_KEYS:
+        unique_indexes = [row[1] for row in conn.execute(f"PRAGMA index_list({table})") if row[2]]
+        if any(
+            {row[2] for row in conn.execute(f"PRAGMA index_info('{name}')")} == set(columns)
+            for name in unique_indexes
+        ):
+            continue
+        try:
+            conn.execute(f"CREATE UNIQUE INDEX IF NOT EXISTS {index_name} ON {table}({', '.join(columns)})")
+            logger.info(f"Index {index_name} créé sur {table}")
+        except sqlite3.Error as e:
+            logger.warning(f"Index {index_name} impossible sur {table}: {e}")
 
-    def get_key(self):
-        return self.current_key
 
-    def rotate_key(self):
-        if len(self.keys) <= 1:
-            return False
-        self.current_index = (self.current_index + 1) % len(self.keys)
-        self.current_key = self.keys[self.current_index]
-        logger.info(f"Rotation vers clé API #{self.current_index + 1}")
-        return True
+@functools.lru_cache(maxsize=4096)
+def _parse_iso_date(value: str) -> datetime:
+    """Date ISO Zerion (suffixe Z) → datetime UTC, mémoïsée par chaîne brute"""
+    return datetime.fromisoformat(value[:-1] + '+00:00' if value.endswith('Z') else value)
+
+
+def _parse_tx_date(value: str) -> datetime:
+    """Date de transaction, maintenant (UTC) si illisible ; les échecs ne sont pas mis en cache"""
+    try:
+        return _parse_iso_date(value)
+    except Exception:
+        return datetime.now(timezone.utc)
+
+
+@functools.lru_cache(maxsize=128)
+def _action_types(operation_type: str) -> Dict:
+    """direction → action_type pour un operation_type ; clé None : autre direction (None = ignoré)"""
+    trade = operation_type in _TRADE_OPS
+    other = None if operation_type in _SKIP_OPS else 'receive' if operation_type in _RECV_OPS else 'send'
+    return {'in': 'buy' if trade else 'receive', 'out': 'sell' if trade else 'send', None: other}
+
+
+def _mined_at_key(tx: Dict) -> str:
+    """Clé de tri chronologique (ISO UTC comparable en chaîne) ; sans date → en dernier"""
+    return tx.get('attributes', {}).get('mined_at') or '\uffff'
+
+
+@functools.cache
+def _insert_transactions_sql(n_rows: int) -> str:
+    """INSERT transaction_history à n_rows lignes VALUES (une seule ligne si n_rows == 1)"""
+    return _SQL_INSERT_TRANSACTION_HEAD + ", ".join([_SQL_TRANSACTION_VALUES] * n_rows)
 
 
-api_manager = APIKeyManager()
+def _insert_transactions(conn: sqlite3.Connection, rows) -> int:
+    """Insère les lignes par paquets multi-VALUES ; retourne le nombre de lignes insérées"""
+    saved = 0
+    rows = iter(rows)
+    while chunk := list(islice(rows, _TX_ROWS_PER_INSERT)):
+        saved += conn.execute(_insert_transactions_sql(len(chunk)), list(chain.from_iterable(chunk))).rowcount
+    return saved
+
+
+def _transaction_rows(wallet_address: str, token_histories: Dict, token_info: Dict):
+    """Lignes transaction_history prêtes pour l'insertion (dates parsées à l'extraction)"""
+    for fid, txs in token_histories.items():
+        info = token_info[fid]
+        for t in txs:
+            yield (
+                wallet_address, fid, info['symbol'], t.date,
+                t.transaction_hash, t.operation_type, t.action_type,
+                info['contract_address'], t.quantity,
+                t.price_per_token, t.value_usd, t.direction
+            )
 
 
 class SimpleWalletHistoryExtractor:
     """Extraction et sauvegarde de l'historique complet par token depuis Zerion"""
 
     def __init__(self):
-        self.headers = {"accept": "application/json", "authorization": f"Basic {api_manager.get_key()}"}
+        self.session = requests.Session()
+        self.session.mount("https://", _HTTP_ADAPTER)
+        self.api_key = get_api_manager().get_key()
+        self.session.headers.update({"accept": "application/json", "authorization": f"Basic {self.api_key}"})
+        self.headers = self.session.headers
         self.db_path = DB_PATH
+        self._conn = None
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        """Connexion SQLite de l'extracteur, ouverte au premier usage (une instance = un thread à la fois)"""
+        if self._conn is None:
+            self._conn = self._connect()
+        return self._conn
+
+    def close(self):
+        """Ferme la connexion SQLite (le pool HTTP, partagé, reste ouvert)"""
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def _connect(self) -> sqlite3.Connection:
+        """Connexion SQLite en WAL, synchronous=NORMAL, transactions explicites"""
+        global _db_initialized
+        # check_same_thread=False : l'extracteur passe d'un worker à l'autre, jamais utilisé en concurrence
+        conn = sqlite3.connect(self.db_path, timeout=5.0, isolation_level=None, check_same_thread=False)
+        if not _db_initialized:
+            conn.execute("PRAGMA journal_mode=WAL")
+            _ensure_unique_keys(conn)
+            _db_initialized = True
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.execute("PRAGMA cache_size=-65536")
+        conn.execute("PRAGMA mmap_size=268435456")
+        return conn
 
     def _update_headers(self):
-        self.headers["authorization"] = f"Basic {api_manager.get_key()}"
+        self.api_key = get_api_manager().get_key()
+        self.headers["authorization"] = f"Basic {self.api_key}"
 
-    def _handle_rate_limit(self, retry_fn=None):
-        if api_manager.rotate_key():
+    def _handle_rate_limit(self, response, attempt: int = 1) -> bool:
+        """429 : attend (Retry-After / backoff), bascule de clé dès le 2e essai ; False après MAX_RETRIES"""
+        if attempt > _WT["MAX_RETRIES"]:
+            return False
+        if attempt >= 2 and get_api_manager().rotate_key(failed_key=self.api_key):
             self._update_headers()
-            time.sleep(_WT["RATE_LIMIT_SLEEP_SECONDS"])
-            return True
-        return False
+        time.sleep(retry_delay(response, attempt, _WT["RETRY_BACKOFF_BASE_SECONDS"], _WT["RETRY_BACKOFF_CAP_SECONDS"]))
+        return True
 
     def get_wallets_to_process(self) -> List[str]:
         """Wallets actifs non encore extraits depuis la table wallets"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-                cursor.execute("SELECT wallet_address FROM wallets WHERE is_active = 1 AND transactions_extracted = 0")
-                wallets = [row[0] for row in cursor.fetchall()]
-                logger.info(f"{len(wallets)} wallets à traiter")
-                return wallets
+            wallets = [row[0] for row in self.conn.execute(
+                "SELECT wallet_address FROM wallets WHERE is_active = 1 AND transactions_extracted = 0"
+            )]
+            logger.info(f"{len(wallets)} wallets à traiter")
+            return wallets
         except sqlite3.Error as e:
             logger.error(f"Erreur lecture DB: {e}")
             return []
 
-    def get_existing_tokens(self, wallet_address: str) -> Dict[str, bool]:
-        """Tokens déjà en base pour ce wallet"""
-        try:
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-                cursor.execute("SELECT fungible_id, in_portfolio FROM tokens WHERE wallet_address = ?", (wallet_address,))
-                return {row[0]: bool(row[1]) for row in cursor.fetchall()}
-        except sqlite3.Error as e:
-            logger.error(f"Erreur lecture tokens: {e}")
-            return {}
-
-    def save_token_to_db(self, wallet_address: str, token_info: Dict):
-        """Sauvegarde un token dans la table tokens"""
-        try:
-            with sqlite3.connect(self.db_path) as conn:
-                conn.execute("""
-                    INSERT OR IGNORE INTO tokens (wallet_address, fungible_id, symbol, contract_address, chain, in_portfolio, created_at, updated_at)
-                    VALUES (?, ?, ?, ?, 'ethereum', 0, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)
-                """, (wallet_address, token_info['fungible_id'], token_info['symbol'], token_info['contract_address']))
-        except sqlite3.Error as e:
-            logger.error(f"Erreur sauvegarde token: {e}")
-
-    def save_transaction_to_db(self, wallet_address: str, token_info: Dict, transaction: Dict):
-        """Sauvegarde une transaction dans transaction_history"""
+    def save_wallet_batch(self, wallet_address: str, token_rows: List[tuple], tx_rows) -> Optional[int]:
+        """Sauvegarde tokens, transactions et marquage du wallet en une seule transaction SQLite ; None si échec"""
+        conn = self.conn
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                try:
-                    tx_date = datetime.fromisoformat(transaction['date'].replace('Z', '+00:00'))
-                except Exception:
-                    tx_date = datetime.now()
-                conn.execute("""
-                    INSERT OR IGNORE INTO transaction_history (
-                        wallet_address, fungible_id, symbol, date, hash,
-                        operation_type, action_type, swap_description, contract_address,
-                        quantity, price_per_token, total_value_usd, direction
-                    ) VALUES (?, ?, ?, ?, ?, ?, ?, NULL, ?, ?, ?, ?, ?)
-                """, (
-                    wallet_address, token_info['fungible_id'], token_info['symbol'], tx_date,
-                    transaction['transaction_hash'], transaction['operation_type'], transaction['action_type'],
-                    token_info['contract_address'], transaction['quantity'],
-                    transaction['price_per_token'], transaction['value_usd'], transaction.get('direction', '')
-                ))
+            conn.execute("BEGIN IMMEDIATE")
+            conn.executemany(_SQL_INSERT_TOKEN, token_rows)
+            saved = _insert_transactions(conn, tx_rows)
+            conn.execute(_SQL_MARK_WALLET_PROCESSED, (wallet_address,))
+            conn.execute("COMMIT")
+            return saved
         except sqlite3.Error as e:
-            logger.error(f"Erreur sauvegarde transaction: {e}")
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            logger.error(f"Erreur sauvegarde wallet {wallet_address[:12]}...: {e}")
+            return None
 
     def mark_wallet_processed(self, wallet_address: str):
         """Marque le wallet comme traité"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                conn.execute("UPDATE wallets SET transactions_extracted = 1, last_sync = CURRENT_TIMESTAMP WHERE wallet_address = ?", (wallet_address,))
+            self.conn.execute(_SQL_MARK_WALLET_PROCESSED, (wallet_address,))
         except sqlite3.Error as e:
             logger.error(f"Erreur mise à jour wallet: {e}")
 
+    def _get(self, url: str, **kwargs):
+        """GET Zerion soumis au limiteur global du process"""
+        _LIMITER.acquire()
+        response = self.session.get(url, **kwargs)
+        _LIMITER.observe(response)
+        return response
+
     def get_complete_transaction_history(self, wallet_address: str, max_pages: int = 2000) -> List[Dict]:
         """Récupère tout l'historique des transactions d'un wallet via Zerion"""
+        # Instance réutilisée entre wallets : reprend la clé courante (rotation par un autre worker)
+        self._update_headers()
         try:
-            resp = requests.get(
+            resp = self._get(
                 f"https://api.zerion.io/v1/wallets/{wallet_address}/positions/?filter[positions]=only_simple&currency=usd&filter[trash]=only_non_trash",
-                headers=self.headers, timeout=_WT["HTTP_TIMEOUT_SECONDS"]
+                timeout=_WT["HTTP_TIMEOUT_SECONDS"]
             )
-            if resp.status_code == 429 and self._handle_rate_limit():
-                resp = requests.get(resp.url, headers=self.headers, timeout=_WT["HTTP_TIMEOUT_SECONDS"])
-            if resp.status_code == 200 and len(resp.json().get("data", [])) > _WT["MAX_PORTFOLIO_TOKENS"]:
+            if resp.status_code == 429 and self._handle_rate_limit(resp):
+                resp = self._get(resp.url, timeout=_WT["HTTP_TIMEOUT_SECONDS"])
+            # Comptage par parsing complet : le marquage bot est définitif
+            if resp.status_code == 200 and len(loads(resp.content).get("data", [])) > _WT["MAX_PORTFOLIO_TOKENS"]:
                 logger.info(f">{_WT['MAX_PORTFOLIO_TOKENS']} tokens - bot/airdrop farmer, skip")
                 self.mark_wallet_processed(wallet_address)
                 return None
         except Exception:
             pass
 
-        base_url = f"https://api.zerion.io/v1/wallets/{wallet_address}/transactions/?filter%5Btrash%5D=only_non_trash&currency=usd&page%5Bsize%5D=100"
+        base_url = f"https://api.zerion.io/v1/wallets/{wallet_address}/transactions/"
+        params = {"filter[trash]": "only_non_trash", "currency": "usd", "page[size]": _WT["PAGE_SIZE"]}
         all_transactions, seen_hashes = [], set()
         page_cursor, page_count = None, 0
+        # Cadence mesurée depuis le début de la requête précédente : la latence réseau et le
+        # parsing comptent dans PAGE_DELAY_SECONDS au lieu de s'y ajouter
+        next_request_at = 0.0
+        rate_limit_attempts = 0  # 429 consécutifs ; la progression (cursor, txs) est conservée
 
         while page_count < max_pages:
-            url = base_url + (f"&page[after]={page_cursor}" if page_cursor else "")
+            if page_cursor:
+                params["page[after]"] = page_cursor
             try:
-                response = requests.get(url, headers=self.headers, timeout=_WT["HTTP_TIMEOUT_SECONDS"])
+                wait = next_request_at - time.monotonic()
+                if wait > 0:
+                    time.sleep(wait)
+                next_request_at = time.monotonic() + _WT["PAGE_DELAY_SECONDS"]
+                response = self._get(base_url, params=params, timeout=_WT["HTTP_TIMEOUT_SECONDS"])
 
                 if response.status_code == 429:
-                    if self._handle_rate_limit():
+                    rate_limit_attempts += 1
+                    if self._handle_rate_limit(response, rate_limit_attempts):
                         continue
+                    logger.warning(f"{wallet_address[:12]}... 429 persistants après {_WT['MAX_RETRIES']} essais")
                     return None
+                rate_limit_attempts = 0
                 if response.status_code == 400:
                     if "Malformed parameter" in response.text:
                         self.mark_wallet_processed(wallet_address)
@@ -160,7 +306,7 @@ class SimpleWalletHistoryExtractor:
                 if response.status_code != 200:
                     return None
 
-                data = response.json()
+                data = loads(response.content)
                 transactions = data.get("data", [])
                 if not transactions:
                     break
@@ -179,15 +325,11 @@ class SimpleWalletHistoryExtractor:
                 next_url = data.get("links", {}).get("next")
                 if not next_url:
                     break
-                if "page%5Bafter%5D=" in next_url:
-                    page_cursor = next_url.split("page%5Bafter%5D=")[1].split("&")[0]
-                elif "page[after]=" in next_url:
-                    page_cursor = next_url.split("page[after]=")[1].split("&")[0]
-                else:
+                page_cursor = parse_qs(urlparse(next_url).query).get("page[after]", [None])[0]
+                if not page_cursor:
                     break
 
                 page_count += 1
-                time.sleep(_WT["PAGE_DELAY_SECONDS"])
 
             except requests.exceptions.HTTPError as e:
                 if e.response.status_code == 500:
@@ -200,38 +342,41 @@ class SimpleWalletHistoryExtractor:
                 time.sleep(_WT["RATE_LIMIT_SLEEP_SECONDS"])
                 break
 
-        logger.info(f"{len(all_transactions)} transactions sur {page_count + 1} pages")
+        logger.info(f"{wallet_address[:12]}... {len(all_transactions)} transactions sur {page_count + 1} pages")
         return all_transactions
 
     def extract_token_histories(self, wallet_address: str, transactions: List[Dict]):
-        """Extrait, filtre par volume et sauvegarde l'historique par token"""
-        existing_tokens = self.get_existing_tokens(wallet_address)
+        """Extrait, filtre par volume et sauvegarde l'historique par token ; (None, None) si la sauvegarde échoue"""
         token_histories = defaultdict(list)
         token_info = {}
+        token_volumes = {}  # fid → [volume USD cumulé, au moins une sortie]
 
-        for tx in transactions:
+        # Tri unique des transactions : l'historique de chaque token est construit déjà ordonné
+        for tx in sorted(transactions, key=_mined_at_key):
             attrs = tx.get('attributes', {})
             operation_type = attrs.get('operation_type', '')
-            tx_date = attrs.get('mined_at', '')
+            actions = _action_types(operation_type)
+            tx_date = None  # parsée une fois par transaction, au premier token retenu
             tx_hash = attrs.get('hash', '')
 
-            transfers_by_token = {}
+            # Agrégation en une passe : fid → [quantité, valeur, premier transfert]
+            agg = {}
             for transfer in attrs.get('transfers', []):
-                finfo = transfer.get('fungible_info', {})
-                fid = finfo.get('id', '')
-                if fid:
-                    transfers_by_token.setdefault(fid, []).append(transfer)
-
-            for fungible_id, token_transfers in transfers_by_token.items():
-                total_qty, total_val, direction, main = 0, 0, None, None
-                for t in token_transfers:
-                    total_qty += float(t.get('quantity', {}).get('numeric', 0) or 0)
-                    total_val += float(t.get('value', 0) or 0)
-                    if main is None:
-                        main = t
-                        direction = t.get('direction', '')
-
-                if not main or total_qty <= 0 or direction == 'self':
+                fid = transfer.get('fungible_info', {}).get('id', '')
+                if not fid:
+                    continue
+                qty = float(transfer.get('quantity', {}).get('numeric', 0) or 0)
+                val = float(transfer.get('value', 0) or 0)
+                rec = agg.get(fid)
+                if rec is None:
+                    agg[fid] = [qty, val, transfer]
+                else:
+                    rec[0] += qty
+                    rec[1] += val
+
+            for fungible_id, (total_qty, total_val, main) in agg.items():
+                direction = main.get('direction', '')
+                if total_qty <= 0 or direction == 'self':
                     continue
 
                 finfo = main.get('fungible_info', {})
@@ -240,11 +385,9 @@ class SimpleWalletHistoryExtractor:
 
                 if not symbol or not fungible_id:
                     continue
-                if len(symbol) > 20 or not symbol.isalnum():
-                    continue
-                if any(k in name.lower() for k in _WT["TRASH_NAMES"]):
+                if not _SYM_RE.match(symbol):
                     continue
-                if any(k in symbol.lower() for k in _WT["TRASH_SYMBOLS"]):
+                if _TRASH_NAME_RE.search(name) or _TRASH_SYMBOL_RE.search(symbol):
                     continue
 
                 impls = finfo.get('implementations', [])
@@ -252,97 +395,126 @@ class SimpleWalletHistoryExtractor:
 
                 token_info.setdefault(fungible_id, {'symbol': symbol, 'name': name, 'contract_address': contract, 'fungible_id': fungible_id})
 
-                if direction == 'in':
-                    action_type = 'buy' if operation_type in ['trade', 'swap', 'execute', 'contract_interaction'] else 'receive'
-                elif direction == 'out':
-                    action_type = 'sell' if operation_type in ['trade', 'swap', 'execute', 'contract_interaction'] else 'send'
+                action_type = actions.get(direction, actions[None])
+                if action_type is None:
+                    continue
+
+                if tx_date is None:
+                    tx_date = _parse_tx_date(attrs.get('mined_at', ''))
+                token_histories[fungible_id].append(TxRecord(
+                    tx_hash, tx_date, direction, action_type,
+                    total_qty, total_val / total_qty, total_val, operation_type
+                ))
+                volume = token_volumes.get(fungible_id)
+                if volume is None:
+                    token_volumes[fungible_id] = [total_val, direction == 'out']
                 else:
-                    if operation_type in ['approve', 'revoke', 'deploy']:
-                        continue
-                    action_type = 'receive' if operation_type in ['receive', 'mint', 'claim'] else 'send'
-
-                token_histories[fungible_id].append({
-                    'transaction_hash': tx_hash,
-                    'date': tx_date,
-                    'direction': direction,
-                    'action_type': action_type,
-                    'quantity': total_qty,
-                    'price_per_token': total_val / total_qty,
-                    'value_usd': total_val,
-                    'operation_type': operation_type
-                })
-
-        for fid in token_histories:
-            token_histories[fid].sort(key=lambda x: x['date'])
-
-        filtered, kept, rejected, saved = {}, 0, 0, 0
+                    volume[0] += total_val
+                    volume[1] = volume[1] or direction == 'out'
+
+        filtered, token_rows, kept, rejected, saved = {}, [], 0, 0, 0
         for fid, txs in token_histories.items():
-            total_vol = sum(t['value_usd'] for t in txs)
-            has_out = any(t['direction'] == 'out' for t in txs)
+            total_vol, has_out = token_volumes[fid]
             if total_vol >= _WT["MIN_TOKEN_VOLUME_USD"] or has_out:
                 filtered[fid] = txs
                 kept += 1
-                if fid not in existing_tokens:
-                    self.save_token_to_db(wallet_address, token_info[fid])
-                for t in txs:
-                    self.save_transaction_to_db(wallet_address, token_info[fid], t)
-                    saved += 1
+                # Tokens déjà en base ignorés par l'INSERT OR IGNORE (clé UNIQUE wallet_address, fungible_id)
+                info = token_info[fid]
+                token_rows.append((wallet_address, fid, info['symbol'], info['contract_address']))
             else:
                 rejected += 1
 
-        logger.info(f"{kept} tokens gardés, {rejected} rejetés, {saved} txs sauvegardées")
+        if filtered:
+            saved = self.save_wallet_batch(
+                wallet_address, token_rows, _transaction_rows(wallet_address, filtered, token_info)
+            )
+            if saved is None:
+                return None, None
+
+        logger.info(f"{wallet_address[:12]}... {kept} tokens gardés, {rejected} rejetés, {saved} txs sauvegardées")
         return filtered, {k: v for k, v in token_info.items() if k in filtered}
 
 
-def extract_wallet_simple_history(wallet_address: str, min_value_usd: float = None):
-    """Extraction complète de l'historique d'un wallet et sauvegarde en base"""
-    extractor = SimpleWalletHistoryExtractor()
-    transactions = extractor.get_complete_transaction_history(wallet_address)
-    if not transactions:
-        logger.warning(f"Aucune transaction récupérée pour {wallet_address[:12]}...")
-        return None
-    token_histories, _ = extractor.extract_token_histories(wallet_address, transactions)
-    if not token_histories:
-        logger.warning(f"Aucun token valide trouvé pour {wallet_address[:12]}...")
-        return None
-    extractor.mark_wallet_processed(wallet_address)
-    logger.info(f"{len(token_histories)} tokens sauvegardés pour {wallet_address[:12]}...")
-    return True
+def extract_wallet_simple_history(wallet_address: str, min_value_usd: float = None,
+                                  extractor: Optional[SimpleWalletHistoryExtractor] = None):
+    """Extraction complète de l'historique d'un wallet et sauvegarde en base.
+
+    extractor : instance réutilisée entre wallets (connexion SQLite et session conservées) ;
+    sans elle, une instance est créée puis fermée pour ce seul wallet.
+    """
+    owned = extractor is None
+    if owned:
+        extractor = SimpleWalletHistoryExtractor()
+    try:
+        transactions = extractor.get_complete_transaction_history(wallet_address)
+        if not transactions:
+            logger.warning(f"Aucune transaction récupérée pour {wallet_address[:12]}...")
+            return None
+        token_histories, _ = extractor.extract_token_histories(wallet_address, transactions)
+        if token_histories is None:
+            # Sauvegarde annulée : wallet non marqué, il sera retraité au prochain passage
+            return None
+        if not token_histories:
+            logger.warning(f"Aucun token valide trouvé pour {wallet_address[:12]}...")
+            return None
+        logger.info(f"{len(token_histories)} tokens sauvegardés pour {wallet_address[:12]}...")
+        return True
+    finally:
+        if owned:
+            extractor.close()
 
 
 def process_all_wallets_from_db(wallet_list: List[str] = None, min_value_usd: float = None, batch_size: int = 10, batch_delay: int = 30):
     """Traite une liste de wallets par batches. Si wallet_list=None, récupère depuis la table wallets."""
-    extractor = SimpleWalletHistoryExtractor()
-    wallets = wallet_list if wallet_list is not None else extractor.get_wallets_to_process()
-
-    if not wallets:
-        logger.info("Aucun wallet à traiter")
-        return
-
-    logger.info(f"{len(wallets)} wallets (batches={batch_size}, délai={batch_delay}s)")
-    total_ok, total_fail = 0, 0
-
-    for batch_id, i in enumerate(range(0, len(wallets), batch_size), 1):
-        batch = wallets[i:i + batch_size]
-        logger.info(f"Batch {batch_id}: {len(batch)} wallets")
-        for idx, wallet in enumerate(batch, 1):
-            try:
-                logger.info(f"[{idx}/{len(batch)}] {wallet[:12]}...")
-                if extract_wallet_simple_history(wallet):
-                    total_ok += 1
-                else:
-                    total_fail += 1
-                if idx < len(batch):
-                    time.sleep(3)
-            except Exception as e:
-                total_fail += 1
-                logger.error(str(e)[:50])
-
-        if i + batch_size < len(wallets):
-            time.sleep(batch_delay)
-
-    logger.info(f"{total_ok}/{len(wallets)} réussis, {total_fail} échecs")
-
+    # Un extracteur par worker pour tout le run (connexion SQLite ouverte une fois), emprunté
+    # le temps d'un wallet : jamais deux threads sur la même instance
+    extractors = [SimpleWalletHistoryExtractor() for _ in range(_WT["MAX_WORKERS"])]
+    idle = queue.SimpleQueue()
+    for extractor in extractors:
+        idle.put(extractor)
+
+    def _extract(wallet):
+        extractor = idle.get()
+        try:
+            return extract_wallet_simple_history(wallet, extractor=extractor)
+        finally:
+            idle.put(extractor)
+
+    try:
+        wallets = wallet_list if wallet_list is not None else extractors[0].get_wallets_to_process()
+        if not wallets:
+            logger.info("Aucun wallet à traiter")
+            return
+
+        logger.info(f"{len(wallets)} wallets (batches={batch_size}, délai={batch_delay}s, workers={_WT['MAX_WORKERS']})")
+        total_ok, total_fail = 0, 0
+
+        for batch_id, i in enumerate(range(0, len(wallets), batch_size), 1):
+            batch = wallets[i:i + batch_size]
+            logger.info(f"Batch {batch_id}: {len(batch)} wallets")
+            # Wallets du batch en parallèle (I/O Zerion + SQLite), la cadence par page reste par wallet
+            with ThreadPoolExecutor(max_workers=min(_WT["MAX_WORKERS"], len(batch))) as executor:
+                futures = {executor.submit(_extract, wallet): wallet for wallet in batch}
+                for idx, future in enumerate(as_completed(futures), 1):
+                    wallet = futures[future]
+                    try:
+                        ok = future.result()
+                    except Exception as e:
+                        ok = False
+                        logger.error(f"{wallet[:12]}... {str(e)[:50]}")
+                    if ok:
+                        total_ok += 1
+                    else:
+                        total_fail += 1
+                    logger.info(f"[{idx}/{len(batch)}] {wallet[:12]}... {'OK' if ok else 'échec'}")
+
+            if i + batch_size < len(wallets):
+                time.sleep(batch_delay)
+
+        logger.info(f"{total_ok}/{len(wallets)} réussis, {total_fail} échecs")
+    finally:
+        for extractor in extractors:
+            extractor.close()
 
 if __name__ == "__main__":
     process_all_wallets_from_db(batch_size=10, batch_delay=10)
@@ -0,0 +1,101 @@
+"""Outils Zerion partagés par les extracteurs wallet_tracker : clés API, cadence et backoff."""
+
+import functools
+import os
+import random
+import threading
+import time
+from collections import deque
+
+from dotenv import load_dotenv
+
+from smart_wallet_analysis.config import ENV_PATH
+from smart_wallet_analysis.logger import get_logger
+
+load_dotenv(dotenv_path=ENV_PATH)
+
+logger = get_logger("wallet_tracker.zerion")
+
+
+def retry_delay(response, attempt, base_seconds, cap_seconds):
+    """Délai avant renvoi : Retry-After si fourni (plafonné), sinon backoff exponentiel avec jitter."""
+    retry_after = response.headers.get("Retry-After")
+    if retry_after:
+        try:
+            return min(float(retry_after), cap_seconds)
+        except ValueError:
+            pass
+    delay = min(cap_seconds, base_seconds * 2 ** (attempt - 1))
+    return delay * random.uniform(0.5, 1.5)
+
+
+class RateLimiter:
+    """Fenêtre glissante : au plus max_calls envois Zerion par période, tous threads confondus."""
+
+    def __init__(self, max_calls, period=1.0, backoff_base=1.0, backoff_cap=60):
+        self.max_calls = max_calls
+        self.period = period
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self._sent = deque()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Bloque jusqu'à ce qu'un envoi soit autorisé, puis l'enregistre."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                while self._sent and now - self._sent[0] >= self.period:
+                    self._sent.popleft()
+                if now >= self._paused_until and len(self._sent) < self.max_calls:
+                    self._sent.append(now)
+                    return
+                wait = max(self._paused_until - now, self._sent[0] + self.period - now if self._sent else 0)
+            time.sleep(wait)
+
+    def observe(self, response):
+        """Suspend les envois quand Zerion annonce un quota épuisé (X-RateLimit-Remaining: 0)."""
+        if response.headers.get("X-RateLimit-Remaining") != "0":
+            return
+        pause = retry_delay(response, 1, self.backoff_base, self.backoff_cap)
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + pause)
+
+
+class APIKeyManager:
+    """Gestion et rotation des clés API Zerion."""
+    def __init__(self):
+        self.keys = [k for k in [os.getenv("ZERION_API_KEY"), os.getenv("ZERION_API_KEY_2")] if k]
+        if not self.keys:
+            raise ValueError("❌ Aucune clé API Zerion trouvée dans .env")
+        self._auth_values = [f"Basic {k}" for k in self.keys]
+        self.current_index = 0
+        self.current_key = self.keys[self.current_index]
+        self._lock = threading.Lock()
+
+    def get_key(self):
+        return self.current_key
+
+    def get_auth(self):
+        """Valeur du header authorization de la clé courante (préformatée)."""
+        return self._auth_values[self.current_index]
+
+    def rotate_key(self, failed_key=None):
+        """Passe à la clé suivante ; no-op si un autre thread a déjà quitté failed_key."""
+        if len(self.keys) <= 1:
+            return False
+        with self._lock:
+            if failed_key is not None and failed_key != self.current_key:
+                return True
+            self.current_index = (self.current_index + 1) % len(self.keys)
+            self.current_key = self.keys[self.current_index]
+            index = self.current_index
+        logger.info(f"Rotation vers clé API #{index + 1}")
+        return True
+
+
+@functools.cache
+def get_api_manager():
+    """APIKeyManager du process, instancié au premier usage : l'import ne lève pas sans clés dans .env."""
+    return APIKeyManager()
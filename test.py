@@ -3,34 +3,131 @@
 Token Discovery via GeckoTerminal API
 Récupère les tokens avec les meilleures performances 24h sur Base et BSC
 """
+import hashlib
+import heapq
 import requests
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
+from operator import itemgetter
 from pathlib import Path
-import json
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import sys
+
+from smart_wallet_analysis.json_utils import dumps, loads
 
 # Configuration
 BASE_URL = "https://api.geckoterminal.com/api/v2"
-RATE_LIMIT_DELAY = 1.5  # secondes entre requêtes
+SEP = "=" * 110  # séparateur des sections affichées
+_EMPTY = {}  # dict vide partagé pour les accès imbriqués (lecture seule)
+MAX_CONCURRENT_REQUESTS = 2  # requêtes simultanées max (remplace la pause fixe entre requêtes)
+RATE_LIMIT_WAIT_SECONDS = 60  # pause sur 429 sans Retry-After (quota GeckoTerminal à la minute)
+MAX_RATE_LIMIT_RETRIES = 5
+_request_slots = threading.BoundedSemaphore(MAX_CONCURRENT_REQUESTS)
+
+# Cache disque des réponses (relances rapprochées, 24h puis 7d) : clé = URL, durée de vie courte
+CACHE_DIR = Path(__file__).parent / "data" / "cache" / "geckoterminal"
+CACHE_TTL_SECONDS = 60
+
+# Session partagée : connexions keep-alive réutilisées, retry urllib3 sur erreurs serveur
+# (les 429 restent gérés par rate_limited_request : le quota GeckoTerminal est à la minute)
+SESSION = requests.Session()
+SESSION.mount("https://", HTTPAdapter(
+    pool_connections=4,
+    pool_maxsize=8,
+    max_retries=Retry(total=3, backoff_factor=1, status_forcelist=[500, 502, 503, 504])
+))
+
+def _cache_path(url):
+    """Fichier cache d'une URL"""
+    return CACHE_DIR / f"{hashlib.sha1(url.encode()).hexdigest()}.json"
+
+def _is_stale(path):
+    """Vrai si l'entrée de cache a dépassé sa durée de vie"""
+    return time.time() - path.stat().st_mtime >= CACHE_TTL_SECONDS
+
+def _read_cache(url):
+    """Réponse en cache si encore fraîche, sinon None (entrée expirée supprimée)"""
+    path = _cache_path(url)
+    try:
+        if not _is_stale(path):
+            return loads(path.read_bytes())
+        path.unlink()
+    except (OSError, ValueError):
+        pass
+    return None
+
+def _prune_cache():
+    """Supprime les entrées expirées (URLs plus redemandées), échecs ignorés"""
+    for path in CACHE_DIR.glob("*.json"):
+        try:
+            if _is_stale(path):
+                path.unlink()
+        except OSError:
+            pass
+
+def _write_cache(url, content):
+    """Écrit la réponse brute en cache (écriture atomique, échec ignoré)"""
+    path = _cache_path(url)
+    tmp_path = path.with_name(f"{path.name}.{threading.get_ident()}.tmp")
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path.write_bytes(content)
+        tmp_path.replace(path)
+    except OSError:
+        pass
+
+def _retry_after(response):
+    """Pause demandée par l'en-tête Retry-After (secondes), sinon pause par défaut"""
+    try:
+        return max(0.0, float(response.headers["Retry-After"]))
+    except (KeyError, ValueError):
+        return RATE_LIMIT_WAIT_SECONDS
 
 def rate_limited_request(url, timeout=15):
     """Effectue une requête avec rate limiting et gestion d'erreurs"""
-    try:
-        time.sleep(RATE_LIMIT_DELAY)
-        response = requests.get(url, timeout=timeout)
+    cached = _read_cache(url)
+    if cached is not None:
+        return cached
 
-        if response.status_code == 429:
-            print("⏳ Rate limit atteint, pause 60s...")
-            time.sleep(60)
-            return rate_limited_request(url, timeout)
+    try:
+        # Boucle bornée sur 429 ; au-delà, raise_for_status remonte l'erreur
+        for attempt in range(MAX_RATE_LIMIT_RETRIES + 1):
+            with _request_slots:
+                response = SESSION.get(url, timeout=timeout)
+            if response.status_code != 429 or attempt == MAX_RATE_LIMIT_RETRIES:
+                break
+            delay = _retry_after(response)
+            print(f"⏳ Rate limit atteint, pause {delay:.0f}s...")
+            time.sleep(delay)
 
         response.raise_for_status()
-        return response.json()
+        data = loads(response.content)
+        _write_cache(url, response.content)
+        return data
 
-    except requests.exceptions.RequestException as e:
+    except (requests.exceptions.RequestException, ValueError) as e:
         print(f"❌ Erreur requête {url}: {e}")
         return None
 
+def _float_field(d, key):
+    """Champ numérique en float : absent, None, "" ou 0 → 0.0 (même règle que float(x or 0))"""
+    value = d.get(key)
+    return float(value) if value else 0.0
+
+def _int_field(d, key):
+    """Champ numérique en int : absent, None, "" ou 0 → 0 (même règle que int(x or 0))"""
+    value = d.get(key)
+    return int(value) if value else 0
+
+def fetch_pools(network):
+    """Récupère trending pools et new pools d'un réseau en parallèle"""
+    urls = [f"{BASE_URL}/networks/{network}/{endpoint}" for endpoint in ("trending_pools", "new_pools")]
+    with ThreadPoolExecutor(max_workers=len(urls)) as executor:
+        return list(executor.map(rate_limited_request, urls))
+
 def get_top_performers(
     network="base",
     min_price_change_24h=20,
@@ -41,7 +138,8 @@ def get_top_performers(
     min_buys_ratio=0.15,
     min_age_hours=24,
     max_age_hours=None,
-    limit=50
+    limit=50,
+    fetched=None
 ):
     """
     Récupère les tokens les plus performants via trending pools
@@ -57,6 +155,7 @@ def get_top_performers(
         min_age_hours: Age minimum du pool en heures (défaut: 24h)
         max_age_hours: Age maximum du pool en heures (None = illimité)
         limit: Nombre max de résultats
+        fetched: Réponses (trending, new) déjà obtenues via fetch_pools (None = récupération ici)
 
     Returns:
         list: Tokens performants triés
@@ -67,17 +166,14 @@ def get_top_performers(
 
     # Combiner trending pools et new pools pour avoir plus de diversité
     all_pools = []
+    data_trending, data_new = fetched if fetched is not None else fetch_pools(network)
 
     # 1. Trending pools (meilleurs performers récents)
-    url_trending = f"{BASE_URL}/networks/{network}/trending_pools"
-    data_trending = rate_limited_request(url_trending)
     if data_trending and 'data' in data_trending:
         all_pools.extend(data_trending.get('data', []))
         print(f"📊 {len(data_trending.get('data', []))} trending pools")
 
     # 2. New pools (pour capturer les nouveaux performers)
-    url_new = f"{BASE_URL}/networks/{network}/new_pools"
-    data_new = rate_limited_request(url_new)
     if data_new and 'data' in data_new:
         all_pools.extend(data_new.get('data', []))
         print(f"🆕 {len(data_new.get('data', []))} new pools")
@@ -90,77 +186,71 @@ def get_top_performers(
 
     top_tokens = []
     seen_tokens = set()
+    # Horloge lue une fois : référence de l'âge des pools et horodatage (local) commun du lot
+    now_utc = datetime.now(timezone.utc)
+    detected_at = now_utc.astimezone().replace(tzinfo=None).isoformat()
 
     for pool in all_pools:
-        attrs = pool.get('attributes', {})
+        attrs = pool.get('attributes') or _EMPTY
+        relationships = pool.get('relationships') or _EMPTY
 
         # Token de base
-        base_token_rel = pool.get('relationships', {}).get('base_token', {}).get('data', {})
+        base_token_rel = (relationships.get('base_token') or _EMPTY).get('data') or _EMPTY
         token_address = base_token_rel.get('id', '').replace(f"{network}_", "")
 
         if not token_address or token_address in seen_tokens:
             continue
 
-        # Prix et variations
-        price_usd = float(attrs.get('base_token_price_usd', 0) or 0)
-        price_changes = attrs.get('price_change_percentage', {})
-        price_change_24h = float(price_changes.get('h24', 0) or 0)
-        price_change_6h = float(price_changes.get('h6', 0) or 0)
-        price_change_1h = float(price_changes.get('h1', 0) or 0)
-
-        # Volume et liquidité
-        volumes = attrs.get('volume_usd', {})
-        volume_24h = float(volumes.get('h24', 0) or 0)
-        liquidity_usd = float(attrs.get('reserve_in_usd', 0) or 0)
-
-        # Market data
-        fdv = float(attrs.get('fdv_usd', 0) or 0)
-        market_cap = float(attrs.get('market_cap_usd', 0) or 0)
-
-        # Transactions
-        txns = attrs.get('transactions', {}).get('h24', {})
-        buys = int(txns.get('buys', 0) or 0)
-        sells = int(txns.get('sells', 0) or 0)
+        # Filtres évalués du plus sélectif / moins coûteux au plus coûteux (arrêt au premier échec)
+        price_changes = attrs.get('price_change_percentage') or _EMPTY
+        price_change_24h = _float_field(price_changes, 'h24')
+        price_usd = _float_field(attrs, 'base_token_price_usd')
+        if not (price_change_24h >= min_price_change_24h and price_usd > 0):
+            continue
+
+        # Volume, liquidité, market data et transactions
+        volumes = attrs.get('volume_usd') or _EMPTY
+        volume_24h = _float_field(volumes, 'h24')
+        liquidity_usd = _float_field(attrs, 'reserve_in_usd')
+        fdv = _float_field(attrs, 'fdv_usd')
+        txns = (attrs.get('transactions') or _EMPTY).get('h24') or _EMPTY
+        buys = _int_field(txns, 'buys')
+        sells = _int_field(txns, 'sells')
         total_txns = buys + sells
         buys_ratio = buys / total_txns if total_txns > 0 else 0
+        if not (
+            volume_24h >= min_volume_24h
+            and liquidity_usd >= min_liquidity
+            and (not fdv > 0 or fdv <= max_fdv)
+            and total_txns >= min_txns_24h
+            and buys_ratio >= min_buys_ratio
+        ):
+            continue
 
-        # Nom du pool
-        pool_name = attrs.get('name', 'UNKNOWN')
+        # Calculer l'âge du pool (parsing de date, seulement pour les pools restants)
         pool_created = attrs.get('pool_created_at', '')
-
-        # Calculer l'âge du pool
         pool_age_hours = 0
         if pool_created:
             try:
                 # Format ISO avec Z -> timezone UTC
                 pool_created_dt = datetime.fromisoformat(pool_created.replace('Z', '+00:00'))
-                now_utc = datetime.now(timezone.utc)
                 pool_age_hours = (now_utc - pool_created_dt).total_seconds() / 3600
             except Exception as e:
                 # Si parsing échoue, considérer comme trop récent (0h)
                 pool_age_hours = 0
 
-        # DEX info
-        dex_rel = pool.get('relationships', {}).get('dex', {}).get('data', {})
-        dex_id = dex_rel.get('id', 'unknown')
-
-        # Appliquer les filtres
-        age_filter_pass = pool_age_hours >= min_age_hours
-        if max_age_hours:
-            age_filter_pass = age_filter_pass and pool_age_hours <= max_age_hours
-
-        if not all([
-            price_change_24h >= min_price_change_24h,
-            volume_24h >= min_volume_24h,
-            liquidity_usd >= min_liquidity,
-            (fdv <= max_fdv if fdv > 0 else True),
-            total_txns >= min_txns_24h,
-            buys_ratio >= min_buys_ratio,
-            price_usd > 0,
-            age_filter_pass  # Filtre d'âge minimum et maximum
-        ]):
+        # Filtre d'âge minimum et maximum
+        if not (pool_age_hours >= min_age_hours and (not max_age_hours or pool_age_hours <= max_age_hours)):
             continue
 
+        # Champs d'affichage, lus seulement pour les pools retenus
+        price_change_6h = _float_field(price_changes, 'h6')
+        price_change_1h = _float_field(price_changes, 'h1')
+        market_cap = _float_field(attrs, 'market_cap_usd')
+        pool_name = attrs.get('name', 'UNKNOWN')
+        dex_rel = (relationships.get('dex') or _EMPTY).get('data') or _EMPTY
+        dex_id = dex_rel.get('id', 'unknown')
+
         seen_tokens.add(token_address)
 
         top_tokens.append({
@@ -195,7 +285,7 @@ def get_top_performers(
             # Métadonnées
             'pool_created_at': pool_created,
             'pool_age_hours': round(pool_age_hours, 1),
-            'detected_at': datetime.now().isoformat(),
+            'detected_at': detected_at,
             'url': f"https://www.geckoterminal.com/{network}/pools/{attrs.get('address', '')}"
         })
 
@@ -203,7 +293,7 @@ def get_top_performers(
             break
 
     # Trier par performance 24h décroissante
-    top_tokens.sort(key=lambda x: x['price_change_24h'], reverse=True)
+    top_tokens = heapq.nlargest(limit, top_tokens, key=itemgetter('price_change_24h'))
 
     print(f"✅ {len(top_tokens)} tokens filtrés")
     return top_tokens
@@ -214,9 +304,8 @@ def display_results(tokens, title="TOP PERFORMERS", limit=15):
         print("❌ Aucun token trouvé")
         return
 
-    print(f"\n{'='*110}")
-    print(f"🚀 {title} - TOP {min(limit, len(tokens))}")
-    print(f"{'='*110}\n")
+    # Sortie construite en mémoire puis écrite en une fois
+    lines = ["", SEP, f"🚀 {title} - TOP {min(limit, len(tokens))}", SEP, ""]
 
     for i, token in enumerate(tokens[:limit], 1):
         # Indicateur de momentum
@@ -234,51 +323,56 @@ def display_results(tokens, title="TOP PERFORMERS", limit=15):
         age_hours = token['pool_age_hours']
         age_display = f"{age_hours:.1f}h" if age_hours < 48 else f"{age_hours/24:.1f}j"
 
-        print(f"[{i}] {momentum} {token['symbol']} ({token['network'].upper()})")
-        print(f"    📍 {token['address']}")
-        print(f"    ⏰ Age: {age_display}")
-        print(f"    💰 Prix: ${token['price_usd']:.10f}")
-        print(f"    📈 Perf: 1h: {token['price_change_1h']:+.1f}% | 6h: {token['price_change_6h']:+.1f}% | 24h: {token['price_change_24h']:+.1f}%")
-        print(f"    💵 Volume 24h: ${token['volume_24h']:,.0f}")
-        print(f"    💧 Liquidité: ${token['liquidity_usd']:,.0f} (V/L: {token['volume_to_liquidity_ratio']:.2f}x)")
-        print(f"    📊 FDV: ${token['fdv']:,.0f}")
-        print(f"    🔄 Txns 24h: {token['txns_24h_total']:,} ({token['txns_24h_buys']} buys / {token['txns_24h_sells']} sells)")
-        print(f"    {sentiment} | Ratio achats: {token['buys_ratio']:.1%}")
-        print(f"    🏪 DEX: {token['dex']}")
-        print(f"    🔗 {token['url']}")
-        print()
+        lines += [
+            f"[{i}] {momentum} {token['symbol']} ({token['network'].upper()})",
+            f"    📍 {token['address']}",
+            f"    ⏰ Age: {age_display}",
+            f"    💰 Prix: ${token['price_usd']:.10f}",
+            f"    📈 Perf: 1h: {token['price_change_1h']:+.1f}% | 6h: {token['price_change_6h']:+.1f}% | 24h: {token['price_change_24h']:+.1f}%",
+            f"    💵 Volume 24h: ${token['volume_24h']:,.0f}",
+            f"    💧 Liquidité: ${token['liquidity_usd']:,.0f} (V/L: {token['volume_to_liquidity_ratio']:.2f}x)",
+            f"    📊 FDV: ${token['fdv']:,.0f}",
+            f"    🔄 Txns 24h: {token['txns_24h_total']:,} ({token['txns_24h_buys']} buys / {token['txns_24h_sells']} sells)",
+            f"    {sentiment} | Ratio achats: {token['buys_ratio']:.1%}",
+            f"    🏪 DEX: {token['dex']}",
+            f"    🔗 {token['url']}",
+            "",
+        ]
+
+    sys.stdout.write("\n".join(lines) + "\n")
 
 def save_results(tokens, filename="top_performers.json"):
     """Sauvegarde les résultats"""
     output_path = Path(__file__).parent / "data" / "raw" / "json" / filename
     output_path.parent.mkdir(parents=True, exist_ok=True)
 
-    with open(output_path, 'w') as f:
-        json.dump(tokens, f, indent=2)
+    # Sérialisation en mémoire puis une seule écriture
+    output_path.write_text(dumps(tokens, indent=True), encoding="utf-8")
 
     print(f"💾 Résultats sauvegardés: {output_path}")
 
 def get_top_gainers_summary(tokens_base, tokens_bsc):
     """Affiche un résumé des meilleurs gainers combinés"""
-    all_tokens = tokens_base + tokens_bsc
-    all_tokens.sort(key=lambda x: x['price_change_24h'], reverse=True)
+    top_gainers = heapq.nlargest(10, tokens_base + tokens_bsc, key=itemgetter('price_change_24h'))
 
-    print(f"\n{'='*110}")
-    print(f"🏆 TOP 10 GAINERS ABSOLUS (BASE + BSC)")
-    print(f"{'='*110}\n")
+    lines = ["", SEP, "🏆 TOP 10 GAINERS ABSOLUS (BASE + BSC)", SEP, ""]
 
-    for i, token in enumerate(all_tokens[:10], 1):
-        print(f"[{i}] {token['symbol']} ({token['network'].upper()}) - +{token['price_change_24h']:.1f}% (24h)")
-        print(f"    Vol: ${token['volume_24h']:,.0f} | Liq: ${token['liquidity_usd']:,.0f}")
-        print(f"    🔗 {token['url']}")
-        print()
+    for i, token in enumerate(top_gainers, 1):
+        lines += [
+            f"[{i}] {token['symbol']} ({token['network'].upper()}) - +{token['price_change_24h']:.1f}% (24h)",
+            f"    Vol: ${token['volume_24h']:,.0f} | Liq: ${token['liquidity_usd']:,.0f}",
+            f"    🔗 {token['url']}",
+            "",
+        ]
+
+    sys.stdout.write("\n".join(lines) + "\n")
 
 # ============================================================================
 # EXÉCUTION PRINCIPALE
 # ============================================================================
 
 if __name__ == "__main__":
-    import sys
+    _prune_cache()
 
     # Paramètre de période depuis la ligne de commande
     timeframe = sys.argv[1] if len(sys.argv) > 1 else "24h"
@@ -298,14 +392,18 @@ if __name__ == "__main__":
         title_suffix = "24H"
         filename_suffix = "24h"
 
-    print("\n" + "="*110)
+    print("\n" + SEP)
     print(f"🦎 GECKOTERMINAL API - TOP PERFORMERS {title_suffix}")
-    print("="*110)
+    print(SEP)
+
+    # Pools des deux réseaux récupérés en parallèle, analyse et affichage ensuite dans l'ordre
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        pools_base, pools_bsc = executor.map(fetch_pools, ("base", "bsc"))
 
     # ========== BASE ==========
-    print("\n" + "="*110)
+    print("\n" + SEP)
     print(f"🔵 BASE NETWORK ({title_suffix})")
-    print("="*110 + "\n")
+    print(SEP + "\n")
 
     tokens_base = get_top_performers(
         network="base",
@@ -317,7 +415,8 @@ if __name__ == "__main__":
         min_buys_ratio=0.15,
         min_age_hours=min_age,
         max_age_hours=max_age,
-        limit=30
+        limit=30,
+        fetched=pools_base
     )
 
     display_results(tokens_base, title=f"BASE TOP PERFORMERS ({title_suffix})", limit=15)
@@ -326,9 +425,9 @@ if __name__ == "__main__":
         save_results(tokens_base, f"top_performers_base_{filename_suffix}.json")
 
     # ========== BSC ==========
-    print("\n" + "="*110)
+    print("\n" + SEP)
     print(f"🟡 BSC (BNB CHAIN) ({title_suffix})")
-    print("="*110 + "\n")
+    print(SEP + "\n")
 
     tokens_bsc = get_top_performers(
         network="bsc",
@@ -340,7 +439,8 @@ if __name__ == "__main__":
         min_buys_ratio=0.15,
         min_age_hours=min_age,
         max_age_hours=max_age,
-        limit=30
+        limit=30,
+        fetched=pools_bsc
     )
 
     display_results(tokens_bsc, title=f"BSC TOP PERFORMERS ({title_suffix})", limit=15)
@@ -349,9 +449,9 @@ if __name__ == "__main__":
         save_results(tokens_bsc, f"top_performers_bsc_{filename_suffix}.json")
 
     # ========== RÉSUMÉ GLOBAL ==========
-    print("\n" + "="*110)
+    print("\n" + SEP)
     print(f"📊 RÉSUMÉ GLOBAL ({title_suffix})")
-    print("="*110)
+    print(SEP)
     print(f"🔵 Base: {len(tokens_base)} tokens performants")
     print(f"🟡 BSC: {len(tokens_bsc)} tokens performants")
     print(f"🎯 Total: {len(tokens_base) + len(tokens_bsc)} opportunités détectées")
@@ -359,7 +459,7 @@ if __name__ == "__main__":
         print(f"⏰ Période analysée: tokens entre {min_age}h et {max_age}h d'âge")
     else:
         print(f"⏰ Période analysée: tokens de {min_age}h+ d'âge")
-    print("="*110)
+    print(SEP)
 
     # Top 10 absolus
     if tokens_base or tokens_bsc: